@@ -3,6 +3,12 @@
 import argparse
 import sys
 
+from datetime import date, datetime
+from dateutil.relativedelta import relativedelta
+
+import psycopg
+from psycopg import sql
+
 from lib.database import Database
 from lib.util import Utilities
 
@@ -68,6 +74,164 @@ class DatabaseManager():
         'downloads_total': 'Total item downloads'
     }
 
+    # Schema used to build the statistics tables of an indexing run before they go live
+    staging_schema = 'dspace_reports_staging'
+
+    # Column definitions of the statistics tables
+    stats_tables = {
+        'repository_stats': """
+            repository_id UUID PRIMARY KEY NOT NULL,
+            repository_name VARCHAR(255) NOT NULL,
+            items_last_month INTEGER DEFAULT 0,
+            items_academic_year INTEGER DEFAULT 0,
+            items_total INTEGER DEFAULT 0,
+            views_last_month INTEGER DEFAULT 0,
+            views_academic_year INTEGER DEFAULT 0,
+            views_total INTEGER DEFAULT 0,
+            downloads_last_month INTEGER DEFAULT 0,
+            downloads_academic_year INTEGER DEFAULT 0,
+            downloads_total INTEGER DEFAULT 0
+        """,
+        'community_stats': """
+            community_id UUID PRIMARY KEY NOT NULL,
+            community_name VARCHAR(255) NOT NULL,
+            community_url VARCHAR(255) NOT NULL,
+            parent_community_name VARCHAR(255),
+            items_last_month INTEGER DEFAULT 0,
+            items_academic_year INTEGER DEFAULT 0,
+            items_total INTEGER DEFAULT 0,
+            views_last_month INTEGER DEFAULT 0,
+            views_academic_year INTEGER DEFAULT 0,
+            views_total INTEGER DEFAULT 0,
+            downloads_last_month INTEGER DEFAULT 0,
+            downloads_academic_year INTEGER DEFAULT 0,
+            downloads_total INTEGER DEFAULT 0
+        """,
+        'collection_stats': """
+            parent_community_name VARCHAR(255) NOT NULL,
+            collection_id UUID PRIMARY KEY NOT NULL,
+            collection_name VARCHAR(255) NOT NULL,
+            collection_url VARCHAR(255) NOT NULL,
+            items_last_month INTEGER DEFAULT 0,
+            items_academic_year INTEGER DEFAULT 0,
+            items_total INTEGER DEFAULT 0,
+            views_last_month INTEGER DEFAULT 0,
+            views_academic_year INTEGER DEFAULT 0,
+            views_total INTEGER DEFAULT 0,
+            downloads_last_month INTEGER DEFAULT 0,
+            downloads_academic_year INTEGER DEFAULT 0,
+            downloads_total INTEGER DEFAULT 0
+        """,
+        'item_stats': """
+            collection_name VARCHAR(255) NOT NULL,
+            item_id UUID PRIMARY KEY NOT NULL,
+            item_name VARCHAR(255) NOT NULL,
+            item_url VARCHAR(255) NOT NULL,
+            views_last_month INTEGER DEFAULT 0,
+            views_academic_year INTEGER DEFAULT 0,
+            views_total INTEGER DEFAULT 0,
+            downloads_last_month INTEGER DEFAULT 0,
+            downloads_academic_year INTEGER DEFAULT 0,
+            downloads_total INTEGER DEFAULT 0
+        """,
+        'item_collection_map': """
+            item_id UUID NOT NULL,
+            collection_id UUID NOT NULL,
+            PRIMARY KEY (item_id, collection_id)
+        """,
+        'collection_community_map': """
+            collection_id UUID NOT NULL,
+            community_id UUID NOT NULL,
+            depth INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (collection_id, community_id)
+        """,
+        'community_hierarchy': """
+            community_id UUID NOT NULL,
+            parent_community_id UUID NOT NULL,
+            PRIMARY KEY (community_id, parent_community_id)
+        """,
+        'statistics_histograms': """
+            entity_type VARCHAR(16) NOT NULL,
+            entity_id UUID NOT NULL,
+            metric VARCHAR(16) NOT NULL,
+            first_month DATE NOT NULL,
+            before_count INTEGER NOT NULL DEFAULT 0,
+            month_counts INTEGER[] NOT NULL,
+            PRIMARY KEY (entity_type, entity_id, metric)
+        """
+    }
+
+    # Statistics columns that collection and community rollups sum from item statistics
+    rollup_columns = ['views_last_month', 'views_academic_year', 'views_total',
+                      'downloads_last_month', 'downloads_academic_year', 'downloads_total']
+
+    # Columns the reports are ordered by, indexed so reports do not sort whole tables
+    stats_indexes = {
+        'repository_stats': ['repository_name'],
+        'community_stats': ['parent_community_name'],
+        'collection_stats': ['parent_community_name'],
+        'item_stats': ['collection_name']
+    }
+
+    # Tables recording the progress of indexing runs so an interrupted run can be resumed
+    run_state_tables = {
+        'indexing_runs': """
+            run_id SERIAL PRIMARY KEY,
+            started_at TIMESTAMP NOT NULL DEFAULT now(),
+            finished_at TIMESTAMP
+        """,
+        'indexing_checkpoints': """
+            run_id INTEGER NOT NULL REFERENCES indexing_runs (run_id) ON DELETE CASCADE,
+            phase VARCHAR(64) NOT NULL,
+            time_period VARCHAR(16) NOT NULL DEFAULT '',
+            date_start VARCHAR(32),
+            date_end VARCHAR(32),
+            facet_offset INTEGER NOT NULL DEFAULT 0,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (run_id, phase, time_period)
+        """,
+        'indexing_tasks': """
+            task_id SERIAL PRIMARY KEY,
+            run_id INTEGER NOT NULL REFERENCES indexing_runs (run_id) ON DELETE CASCADE,
+            stage INTEGER NOT NULL DEFAULT 1,
+            task_type VARCHAR(32) NOT NULL,
+            task_key VARCHAR(255) NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker VARCHAR(255),
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            error TEXT,
+            UNIQUE (run_id, task_type, task_key)
+        """
+    }
+
+    # Long-format history of the statistics of every indexing run, partitioned by month.
+    # It is not dropped with the statistics tables so history survives a recreate.
+    history_table = 'statistics_facts'
+    history_columns = """
+        entity_type VARCHAR(16) NOT NULL,
+        entity_id UUID NOT NULL,
+        metric VARCHAR(16) NOT NULL,
+        period_start DATE NOT NULL,
+        period_end DATE NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        run_id INTEGER NOT NULL,
+        PRIMARY KEY (entity_type, entity_id, metric, period_start, period_end, run_id)
+    """
+
+    # Time up to which each facet spec was added to the daily store in incremental mode.
+    # Like the history it is not dropped with the statistics tables, as it belongs to the
+    # local daily store.
+    watermark_table = 'statistics_watermarks'
+    watermark_columns = """
+        phase VARCHAR(64) PRIMARY KEY,
+        watermark TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT now()
+    """
+
     def __init__(self, config=None):
         if config is None:
             print('A configuration file required to create the community stats indexer.')
@@ -83,80 +247,287 @@ class DatabaseManager():
         with Database(config=config['statistics_db']) as db:
             with db.cursor() as cursor:
                 # Create new statistics tables
-                commands = (
-                    """
-                    CREATE TABLE repository_stats (
-                        repository_id UUID PRIMARY KEY NOT NULL,
-                        repository_name VARCHAR(255) NOT NULL,
-                        items_last_month INTEGER DEFAULT 0,
-                        items_academic_year INTEGER DEFAULT 0,
-                        items_total INTEGER DEFAULT 0,
-                        views_last_month INTEGER DEFAULT 0,
-                        views_academic_year INTEGER DEFAULT 0,
-                        views_total INTEGER DEFAULT 0,
-                        downloads_last_month INTEGER DEFAULT 0,
-                        downloads_academic_year INTEGER DEFAULT 0,
-                        downloads_total INTEGER DEFAULT 0
-                    )
-                    """,
-                    """
-                    CREATE TABLE community_stats (
-                        community_id UUID PRIMARY KEY NOT NULL,
-                        community_name VARCHAR(255) NOT NULL,
-                        community_url VARCHAR(255) NOT NULL,
-                        parent_community_name VARCHAR(255),
-                        items_last_month INTEGER DEFAULT 0,
-                        items_academic_year INTEGER DEFAULT 0,
-                        items_total INTEGER DEFAULT 0,
-                        views_last_month INTEGER DEFAULT 0,
-                        views_academic_year INTEGER DEFAULT 0,
-                        views_total INTEGER DEFAULT 0,
-                        downloads_last_month INTEGER DEFAULT 0,
-                        downloads_academic_year INTEGER DEFAULT 0,
-                        downloads_total INTEGER DEFAULT 0
-                    )
-                    """,
-                    """
-                    CREATE TABLE collection_stats (
-                        parent_community_name VARCHAR(255) NOT NULL,
-                        collection_id UUID PRIMARY KEY NOT NULL,
-                        collection_name VARCHAR(255) NOT NULL,
-                        collection_url VARCHAR(255) NOT NULL,
-                        items_last_month INTEGER DEFAULT 0,
-                        items_academic_year INTEGER DEFAULT 0,
-                        items_total INTEGER DEFAULT 0,
-                        views_last_month INTEGER DEFAULT 0,
-                        views_academic_year INTEGER DEFAULT 0,
-                        views_total INTEGER DEFAULT 0,
-                        downloads_last_month INTEGER DEFAULT 0,
-                        downloads_academic_year INTEGER DEFAULT 0,
-                        downloads_total INTEGER DEFAULT 0
-                    )
-                    """,
-                    """
-                    CREATE TABLE item_stats (
-                        collection_name VARCHAR(255) NOT NULL,
-                        item_id UUID PRIMARY KEY NOT NULL,
-                        item_name VARCHAR(255) NOT NULL,
-                        item_url VARCHAR(255) NOT NULL,
-                        views_last_month INTEGER DEFAULT 0,
-                        views_academic_year INTEGER DEFAULT 0,
-                        views_total INTEGER DEFAULT 0,
-                        downloads_last_month INTEGER DEFAULT 0,
-                        downloads_academic_year INTEGER DEFAULT 0,
-                        downloads_total INTEGER DEFAULT 0
-                    )
-                    """
-                )
-
-                for command in commands:
-                    cursor.execute(command)
+                for table_name, table_columns in self.stats_tables.items():
+                    cursor.execute(sql.SQL("CREATE TABLE {} ({})").format(
+                        sql.Identifier(table_name), sql.SQL(table_columns)))
 
             # Commit changes
             db.commit()
 
+        self.create_indexes(config, logger)
+        self.create_run_state_tables(config, logger)
+        self.create_watermark_table(config, logger)
+
         logger.info('Finished creating tables.')
 
+    def create_indexes(self, config, logger, schema=None):
+        """Function to create the indexes used by the reports if they do not exist"""
+        logger.debug('Creating statistics table indexes...')
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                for table_name, columns in self.stats_indexes.items():
+                    table = sql.Identifier(table_name)
+                    if schema is not None:
+                        table = sql.Identifier(schema, table_name)
+
+                    for column in columns:
+                        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ({})").format(
+                            sql.Identifier(f"{table_name}_{column}_idx"), table,
+                            sql.Identifier(column)))
+
+            # Commit changes
+            db.commit()
+
+    def analyze_tables(self, config, logger, schema=None, tables=None):
+        """Function to update the planner statistics of the statistics tables"""
+
+        if tables is None:
+            tables = list(self.stats_tables)
+
+        logger.info('Analyzing tables: %s', ', '.join(tables))
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                for table_name in tables:
+                    table = sql.Identifier(table_name)
+                    if schema is not None:
+                        table = sql.Identifier(schema, table_name)
+                    cursor.execute(sql.SQL("ANALYZE {}").format(table))
+
+            # Commit changes
+            db.commit()
+
+    def create_run_state_tables(self, config, logger):
+        """Function to create the indexing run state tables if they do not exist"""
+        logger.debug('Creating indexing run state tables...')
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                for table_name, table_columns in self.run_state_tables.items():
+                    cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({})").format(
+                        sql.Identifier(table_name), sql.SQL(table_columns)))
+
+            # Commit changes
+            db.commit()
+
+    def create_watermark_table(self, config, logger):
+        """Function to create the incremental watermark table if it does not exist"""
+        logger.debug('Creating watermark table...')
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({})").format(
+                    sql.Identifier(self.watermark_table), sql.SQL(self.watermark_columns)))
+
+            # Commit changes
+            db.commit()
+
+    def create_history_tables(self, config, logger):
+        """Function to create the statistics history table if it does not exist"""
+        logger.debug('Creating statistics history table...')
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({}) PARTITION BY RANGE (period_end)").format(sql.Identifier(self.history_table), sql.SQL(self.history_columns)))
+
+                # Rows outside of the monthly partitions end up here
+                cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT").format(sql.Identifier(self.history_table + '_default'), sql.Identifier(self.history_table)))
+
+                # The primary key covers trends of one entity. These cover the statistics of
+                # a run and repository-wide trends of a metric.
+                cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (run_id)").format(sql.Identifier(self.history_table + '_run_id_idx'), sql.Identifier(self.history_table)))
+                cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (entity_type, metric, period_end)").format(sql.Identifier(self.history_table + '_metric_idx'), sql.Identifier(self.history_table)))
+
+            # Commit changes
+            db.commit()
+
+    def create_history_partition(self, config, logger, day=None):
+        """Function to create the monthly statistics history partition of a day"""
+
+        if day is None:
+            day = date.today()
+
+        month_start = day.replace(day=1)
+        next_month_start = month_start + relativedelta(months=1)
+        partition_name = f"{self.history_table}_{month_start.strftime('%Y_%m')}"
+        logger.debug('Creating statistics history partition: %s', partition_name)
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(sql.Identifier(partition_name), sql.Identifier(self.history_table), sql.Literal(month_start), sql.Literal(next_month_start)))
+
+            # Commit changes
+            db.commit()
+
+    def prune_history(self, config, logger, retention_months=None):
+        """Function to drop statistics history older than the retention period"""
+
+        if not retention_months:
+            return
+
+        cutoff = date.today().replace(day=1) - relativedelta(months=retention_months)
+        logger.info('Removing statistics history from before %s.', cutoff.isoformat())
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT child.relname FROM pg_inherits JOIN pg_class parent ON parent.oid = pg_inherits.inhparent JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE parent.relname = %s", (self.history_table,))
+                partition_names = [row[0] for row in cursor.fetchall()]
+
+                # Whole months are removed by dropping their partitions
+                for partition_name in partition_names:
+                    suffix = partition_name[len(self.history_table) + 1:]
+                    try:
+                        partition_month = datetime.strptime(suffix, '%Y_%m').date()
+                    except ValueError:
+                        continue
+
+                    if partition_month < cutoff:
+                        logger.debug('Dropping statistics history partition: %s', partition_name)
+                        cursor.execute(sql.SQL("DROP TABLE {}").format(
+                            sql.Identifier(partition_name)))
+
+                cursor.execute(sql.SQL("DELETE FROM {} WHERE period_end < %s").format(
+                    sql.Identifier(self.history_table + '_default')), (cutoff,))
+
+            # Commit changes
+            db.commit()
+
+    def rollup_statistics(self, config, logger, entity_type=None, entity_ids=None):
+        """Function to compute collection and community views and downloads from items
+
+        With entity_type 'collection' or 'community' only that table is computed, and with
+        entity_ids only the rows of those UUIDs.
+        """
+        logger.info('Computing collection and community statistics from item statistics...')
+
+        sums = sql.SQL(', ').join(
+            sql.SQL("SUM(item_stats.{}) AS {}").format(sql.Identifier(column),
+                                                        sql.Identifier(column))
+            for column in self.rollup_columns)
+        zeros = sql.SQL(', ').join(
+            sql.SQL("{} = 0").format(sql.Identifier(column)) for column in self.rollup_columns)
+        updates = sql.SQL(', ').join(
+            sql.SQL("{} = rollup.{}").format(sql.Identifier(column), sql.Identifier(column))
+            for column in self.rollup_columns)
+
+        def entity_condition(table, key_column):
+            """Limit the updated rows of a table to entity_ids"""
+            if entity_ids is None:
+                return sql.SQL("TRUE"), []
+            return (sql.SQL("{}.{}::text = ANY(%s)").format(sql.Identifier(table),
+                                                             sql.Identifier(key_column)),
+                    [sorted(entity_ids)])
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                # Add the ancestors of each collection's parent community to the mapping
+                cursor.execute("DELETE FROM collection_community_map WHERE depth > 1")
+                cursor.execute("WITH RECURSIVE ancestors (collection_id, community_id, depth) AS (SELECT collection_id, community_id, depth FROM collection_community_map WHERE depth = 1 UNION SELECT ancestors.collection_id, community_hierarchy.parent_community_id, ancestors.depth + 1 FROM ancestors JOIN community_hierarchy ON community_hierarchy.community_id = ancestors.community_id) INSERT INTO collection_community_map (collection_id, community_id, depth) SELECT collection_id, community_id, MIN(depth) FROM ancestors WHERE depth > 1 GROUP BY collection_id, community_id ON CONFLICT DO NOTHING")
+
+                # Collections without items keep zeros
+                if entity_type in (None, 'collection'):
+                    condition, params = entity_condition('collection_stats', 'collection_id')
+                    cursor.execute(sql.SQL("UPDATE collection_stats SET {} WHERE {}").format(zeros, condition), params)
+                    cursor.execute(sql.SQL("UPDATE collection_stats SET {} FROM (SELECT item_collection_map.collection_id, {} FROM item_collection_map JOIN item_stats ON item_stats.item_id = item_collection_map.item_id GROUP BY item_collection_map.collection_id) AS rollup WHERE collection_stats.collection_id = rollup.collection_id AND {}").format(updates, sums, condition), params)
+
+                # Items are counted once per community, however many collections link them
+                if entity_type in (None, 'community'):
+                    condition, params = entity_condition('community_stats', 'community_id')
+                    cursor.execute(sql.SQL("UPDATE community_stats SET {} WHERE {}").format(zeros, condition), params)
+                    cursor.execute(sql.SQL("UPDATE community_stats SET {} FROM (SELECT community_items.community_id, {} FROM (SELECT DISTINCT item_collection_map.item_id, collection_community_map.community_id FROM item_collection_map JOIN collection_community_map ON collection_community_map.collection_id = item_collection_map.collection_id) AS community_items JOIN item_stats ON item_stats.item_id = community_items.item_id GROUP BY community_items.community_id) AS rollup WHERE community_stats.community_id = rollup.community_id AND {}").format(updates, sums, condition), params)
+
+            # Commit changes
+            db.commit()
+
+        logger.info('Finished computing collection and community statistics.')
+
+    def create_staging_tables(self, config, logger, unlogged=False):
+        """Function to create empty statistics tables in the staging schema"""
+        logger.info('Creating staging tables in schema: %s', self.staging_schema)
+
+        # UNLOGGED tables skip the write-ahead log while they are being filled
+        table_type = sql.SQL("UNLOGGED TABLE") if unlogged else sql.SQL("TABLE")
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                # Discard anything left over from an earlier run that did not finish
+                cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(
+                    sql.Identifier(self.staging_schema)))
+                cursor.execute(sql.SQL("CREATE SCHEMA {}").format(
+                    sql.Identifier(self.staging_schema)))
+
+                # Primary keys are kept because the indexers look up rows by ID while loading.
+                # The other indexes are built after loading, before the swap.
+                for table_name, table_columns in self.stats_tables.items():
+                    cursor.execute(sql.SQL("CREATE {} {}.{} ({})").format(
+                        table_type, sql.Identifier(self.staging_schema),
+                        sql.Identifier(table_name), sql.SQL(table_columns)))
+
+            # Commit changes
+            db.commit()
+
+        logger.info('Finished creating staging tables.')
+
+    def staging_config(self, config):
+        """Return a copy of the configuration that writes to the staging tables"""
+
+        staging_config = dict(config)
+        staging_config['statistics_db'] = dict(config['statistics_db'])
+        staging_config['statistics_db']['schema'] = self.staging_schema
+        return staging_config
+
+    def swap_staging_tables(self, config, logger, lock_timeout='5s', attempts=3):
+        """Function to replace the live statistics tables with the staging tables"""
+        logger.info('Swapping staging tables into place...')
+
+        with Database(config=config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                # Live tables are in the default schema of the statistics database
+                cursor.execute("SELECT current_schema()")
+                live_schema = cursor.fetchone()[0]
+
+                # Make the new tables crash-safe before the swap so that the rewrite of
+                # UNLOGGED tables does not happen while holding locks on the live tables
+                for table_name in self.stats_tables:
+                    cursor.execute(sql.SQL("ALTER TABLE {}.{} SET LOGGED").format(
+                        sql.Identifier(self.staging_schema), sql.Identifier(table_name)))
+                db.commit()
+
+                # Indexes are only built now that the tables are loaded, and the planner
+                # statistics are ready before the first report reads the new tables
+                self.create_indexes(config, logger, schema=self.staging_schema)
+                self.analyze_tables(config, logger, schema=self.staging_schema)
+
+                # Swap all tables in one transaction. Readers see either the previous run
+                # or the new one. The lock timeout keeps the swap from queueing readers
+                # behind it while a long report query is still running.
+                for attempt in range(1, attempts + 1):
+                    try:
+                        cursor.execute(sql.SQL("SET LOCAL lock_timeout = {}").format(
+                            sql.Literal(lock_timeout)))
+                        for table_name in self.stats_tables:
+                            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}.{}").format(
+                                sql.Identifier(live_schema), sql.Identifier(table_name)))
+                            cursor.execute(sql.SQL("ALTER TABLE {}.{} SET SCHEMA {}").format(
+                                sql.Identifier(self.staging_schema), sql.Identifier(table_name),
+                                sql.Identifier(live_schema)))
+                        cursor.execute(sql.SQL("DROP SCHEMA {}").format(
+                            sql.Identifier(self.staging_schema)))
+                        db.commit()
+                        break
+                    except psycopg.errors.LockNotAvailable:
+                        db.rollback()
+                        logger.warning("Statistics tables are busy, retrying swap (attempt " +
+                                       "%s of %s).", attempt, attempts)
+                else:
+                    logger.error("Unable to swap staging tables. The staging tables were " +
+                                 "left in schema %s.", self.staging_schema)
+                    return False
+
+        logger.info('Finished swapping staging tables.')
+        return True
+
     def drop_tables(self, config, logger):
         """Function to drop statistics tables"""
         # First check that tables exist
@@ -183,6 +554,27 @@ class DatabaseManager():
                     """,
                     """
                     DROP TABLE item_stats
+                    """,
+                    """
+                    DROP TABLE IF EXISTS item_collection_map
+                    """,
+                    """
+                    DROP TABLE IF EXISTS collection_community_map
+                    """,
+                    """
+                    DROP TABLE IF EXISTS community_hierarchy
+                    """,
+                    """
+                    DROP TABLE IF EXISTS statistics_histograms
+                    """,
+                    """
+                    DROP TABLE IF EXISTS indexing_tasks
+                    """,
+                    """
+                    DROP TABLE IF EXISTS indexing_checkpoints
+                    """,
+                    """
+                    DROP TABLE IF EXISTS indexing_runs
                     """
                 )
 
@@ -0,0 +1,156 @@
+"""Indexer methods for the local daily statistics store"""
+
+import json
+import math
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from time import sleep
+
+from lib.daily_store import DailyStore
+
+
+class DailyStoreMixin():
+    """Indexer methods for filling the daily counts of every entity in a DailyStore"""
+
+    def get_daily_store(self, facet_spec=None):
+        """Open the local daily store of a facet spec"""
+
+        try:
+            return DailyStore(directory=self.daily_store_dir, name=facet_spec['phase'],
+                              first_day=date.fromisoformat(self.daily_store_start))
+        except ImportError as err:
+            self.logger.warning("Unable to open the daily store: %s", err)
+            return None
+
+    def update_daily_store(self, facet_spec=None):
+        """Fill the daily store of a facet spec with the complete days since it was last filled"""
+
+        store = self.get_daily_store(facet_spec=facet_spec)
+        if store is None:
+            return
+
+        start_day = store.filled_until or store.first_day
+        self.fill_daily_store(facet_spec=facet_spec, store=store, start_day=start_day,
+                              end_day=date.today())
+
+    def fill_daily_store(self, facet_spec=None, store=None, start_day=None, end_day=None):
+        """Set the daily counts of a facet spec from start_day up to, not including, end_day"""
+
+        if facet_spec is None or store is None or start_day is None or end_day is None:
+            return
+
+        # Get Solr shards
+        shards = self.solr.get_statistics_shards()
+
+        # Fill a limited number of days at a time so responses stay small
+        chunk_start = start_day
+        while chunk_start < end_day:
+            chunk_end = min(chunk_start + timedelta(days=self.daily_store_chunk_days), end_day)
+            self.logger.info("Filling daily store %s: %s - %s", facet_spec['phase'],
+                             chunk_start.isoformat(), chunk_end.isoformat())
+
+            # Days are replaced as a whole, so entities without documents are set to 0
+            store.clear_days(start_day=chunk_start, end_day=chunk_end)
+            for uuids, counts in self.fetch_daily_counts(
+                    facet_spec=facet_spec, shards=shards,
+                    time_start=datetime.combine(chunk_start, datetime.min.time()),
+                    time_end=datetime.combine(chunk_end, datetime.min.time())):
+                store.set_counts(uuids=uuids, start_day=chunk_start, counts=counts)
+
+            # Record the filled days so an interrupted fill continues from here. Back-filling
+            # older days does not move the end of the filled days.
+            filled_until = store.filled_until or store.first_day
+            if chunk_start <= filled_until:
+                filled_until = max(filled_until, chunk_end)
+            store.flush(filled_until=filled_until)
+            chunk_start = chunk_end
+
+    def fetch_daily_counts(self, facet_spec=None, shards=None, time_start=None, time_end=None):
+        """Get pages of (UUIDs, daily counts) of the documents from time_start until time_end
+
+        The daily counts of every UUID start on the day of time_start.
+        """
+
+        phase = facet_spec['phase']
+        facet_field = facet_spec['facet_field']
+
+        # Create base Solr url
+        solr_url = self.solr_server + "/statistics/select"
+
+        # Day buckets cover whole days, the query limits them to the documents in the times
+        first_day = time_start.date()
+        last_day = time_end.date()
+        if time_end.time() != datetime.min.time():
+            last_day = last_day + timedelta(days=1)
+        num_days = (last_day - first_day).days
+
+        query = (f"type:{facet_spec['type']} AND {facet_field}:/.{{36}}/ AND " +
+                 f"time:[{time_start.isoformat()}Z TO {time_end.isoformat()}Z}}")
+
+        results_total_num_facets = self.get_facet_count(facet_spec=facet_spec, query=query,
+                                                        shards=shards)
+        if results_total_num_facets is None:
+            return []
+
+        results_per_page = self.facet_page_size
+        results_num_pages = math.ceil(results_total_num_facets / results_per_page)
+
+        def fetch_page(results_current_page):
+            """Fetch the daily counts of a page of facet values from Solr"""
+
+            json_facet = {
+                "ids": {
+                    "type": "terms",
+                    "field": facet_field,
+                    "offset": results_current_page * results_per_page,
+                    "limit": results_per_page,
+                    "mincount": 1,
+                    "sort": "index asc",
+                    "facet": {
+                        "days": {
+                            "type": "range",
+                            "field": "time",
+                            "start": first_day.isoformat() + 'T00:00:00Z',
+                            "end": last_day.isoformat() + 'T00:00:00Z',
+                            "gap": "+1DAY"
+                        }
+                    }
+                }
+            }
+
+            solr_query_params = {
+                "q": query,
+                "fq": facet_spec['filters'],
+                "shards": shards,
+                "rows": 0,
+                "wt": "json",
+                "json.facet": json.dumps(json_facet)
+            }
+
+            response = self.solr.call(url=solr_url, params=solr_query_params)
+            self.logger.debug("Solr %s daily counts query: %s", phase, response.url)
+
+            if self.delay:
+                sleep(self.delay)
+
+            uuids = []
+            counts = []
+            for bucket in response.json()["facets"].get("ids", {}).get("buckets", []):
+                if len(bucket["val"]) != 36:
+                    self.logger.warning("%s value is not a UUID: %s", facet_field, bucket["val"])
+                    continue
+
+                day_counts = [0] * num_days
+                for day_bucket in bucket["days"]["buckets"]:
+                    day_index = (date.fromisoformat(day_bucket["val"][0:10]) - first_day).days
+                    if 0 <= day_index < num_days:
+                        day_counts[day_index] = day_bucket["count"]
+
+                uuids.append(bucket["val"])
+                counts.append(day_counts)
+
+            return uuids, counts
+
+        with ThreadPoolExecutor(max_workers=self.solr_workers) as executor:
+            return list(executor.map(fetch_page, range(results_num_pages)))
@@ -0,0 +1,199 @@
+"""Indexer methods for monthly histograms of views and downloads"""
+
+import json
+import math
+
+from datetime import date, datetime
+from time import sleep
+from dateutil.relativedelta import relativedelta
+from psycopg import sql
+
+from lib.database import Database
+
+
+class HistogramMixin():
+    """Indexer methods for keeping monthly counts of every entity in statistics_histograms
+
+    Every time period is derived from the monthly counts, so Solr is queried once per
+    facet spec instead of once per time period.
+    """
+
+    def index_facet_histogram(self, facet_spec=None):
+        """Index the monthly counts of one facet spec and derive the time periods from them"""
+
+        if facet_spec is None:
+            return
+
+        phase = facet_spec['phase']
+        facet_field = facet_spec['facet_field']
+        metric = facet_spec['metric']
+
+        # Months from the start of the histograms up to and including the current month
+        first_month = datetime.strptime(self.histogram_start[0:7], '%Y-%m').date()
+        end_month = date.today().replace(day=1) + relativedelta(months=1)
+        months = [first_month + relativedelta(months=i) for i in
+                  range((end_month.year - first_month.year) * 12 +
+                        end_month.month - first_month.month)]
+        month_indexes = {month.isoformat()[0:7]: i for i, month in enumerate(months)}
+        date_range = [first_month.isoformat() + 'T00:00:00Z',
+                      end_month.isoformat() + 'T00:00:00Z']
+
+        if not self.is_phase_completed(phase=phase, time_period='histogram'):
+            # Create base Solr url
+            solr_url = self.solr_server + "/statistics/select"
+
+            # Get Solr shards
+            shards = self.solr.get_statistics_shards()
+
+            # Histograms cover all time, documents before the first month are counted apart
+            query = f"type:{facet_spec['type']} AND {facet_field}:/.{{36}}/"
+
+            results_total_num_facets = self.get_facet_count(facet_spec=facet_spec, query=query,
+                                                            shards=shards)
+            if results_total_num_facets is None:
+                return
+
+            results_per_page = self.facet_page_size
+            results_num_pages = math.ceil(results_total_num_facets / results_per_page)
+            results_first_page = self.get_facet_offset(phase=phase, time_period='histogram')
+
+            def fetch_page(results_current_page):
+                """Fetch the monthly counts of a page of facet values from Solr"""
+
+                print(
+                    f"Indexing {phase} histograms (page {results_current_page + 1} " +
+                    f"of {results_num_pages})"
+                )
+
+                json_facet = {
+                    "ids": {
+                        "type": "terms",
+                        "field": facet_field,
+                        "offset": results_current_page * results_per_page,
+                        "limit": results_per_page,
+                        "mincount": 1,
+                        "sort": "index asc",
+                        "facet": {
+                            "months": {
+                                "type": "range",
+                                "field": "time",
+                                "start": date_range[0],
+                                "end": date_range[1],
+                                "gap": "+1MONTH",
+                                "other": "before"
+                            }
+                        }
+                    }
+                }
+
+                solr_query_params = {
+                    "q": query,
+                    "fq": facet_spec['filters'],
+                    "shards": shards,
+                    "rows": 0,
+                    "wt": "json",
+                    "json.facet": json.dumps(json_facet)
+                }
+
+                response = self.solr.call(url=solr_url, params=solr_query_params)
+                self.logger.info("Solr %s histograms query: %s", phase, response.url)
+
+                if self.delay:
+                    sleep(self.delay)
+
+                rows = []
+                for bucket in response.json()["facets"].get("ids", {}).get("buckets", []):
+                    uuid = bucket["val"]
+                    if len(uuid) != 36:
+                        self.logger.warning("%s value is not a UUID: %s", facet_field, uuid)
+                        continue
+
+                    month_counts = [0] * len(months)
+                    for month_bucket in bucket["months"]["buckets"]:
+                        month_index = month_indexes.get(month_bucket["val"][0:7])
+                        if month_index is not None:
+                            month_counts[month_index] = month_bucket["count"]
+
+                    before_count = bucket["months"].get("before", {}).get("count", 0)
+                    rows.append((uuid, metric, (first_month, before_count, month_counts)))
+
+                return rows
+
+            # Fetch pages from Solr while the previous pages are written to the database
+            self.run_facet_pipeline(phase=phase, time_period='histogram', date_range=date_range,
+                                    pages=range(results_first_page, results_num_pages),
+                                    fetch_page=fetch_page,
+                                    entity_type=facet_spec['entity_type'],
+                                    table=facet_spec['table'],
+                                    key_column=facet_spec['key_column'],
+                                    write_rows=self.write_histogram_rows)
+
+        self.derive_histogram_windows(facet_spec=facet_spec, months=months)
+
+    def derive_histogram_windows(self, facet_spec=None, months=None):
+        """Set the time period columns of a facet spec from the stored monthly counts"""
+
+        if facet_spec is None or not months:
+            return
+
+        metric = facet_spec['metric']
+        table = facet_spec['table']
+
+        # Time periods are whole calendar months: the previous month, the academic year up
+        # to the current month and all months plus the documents before the first month
+        current_month = date.today().replace(day=1)
+        first_months = {
+            'month': current_month + relativedelta(months=-1),
+            'year': date(current_month.year if current_month.month > 9 else
+                         current_month.year - 1, 9, 1),
+            'all': months[0]
+        }
+        last_months = {
+            'month': current_month + relativedelta(months=-1),
+            'year': current_month,
+            'all': current_month
+        }
+
+        def month_index(month):
+            """Postgres array index (1-based) of a month, kept inside the histogram"""
+            index = (month.year - months[0].year) * 12 + month.month - months[0].month + 1
+            return min(max(index, 1), len(months))
+
+        set_columns = []
+        params = []
+        for time_period in self.time_periods:
+            # Array slices include both ends
+            first_index = month_index(first_months[time_period])
+            last_index = month_index(last_months[time_period])
+            column_value = sql.SQL(
+                "COALESCE((SELECT sum(c) FROM unnest(h.month_counts[%s:%s]) AS c), 0)")
+            if time_period == 'all':
+                column_value = sql.SQL("h.before_count + {}").format(column_value)
+
+            set_columns.append(sql.SQL("{} = {}").format(
+                sql.Identifier(self.get_period_column(metric, time_period)), column_value))
+            params.extend([first_index, last_index])
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                # Entities without statistics documents have no histogram
+                key_condition, key_params = self.get_key_condition(facet_spec)
+                cursor.execute(sql.SQL("UPDATE {} SET {} WHERE {}").format(
+                    sql.Identifier(table), sql.SQL(', ').join(
+                        sql.SQL("{} = 0").format(
+                            sql.Identifier(self.get_period_column(metric, time_period)))
+                        for time_period in self.time_periods), key_condition),
+                    key_params)
+
+                # Only the rows of this partition and scope, like the statement above
+                key_condition, key_params = self.get_key_condition(facet_spec, table_alias='t')
+                cursor.execute(sql.SQL("UPDATE {} AS t SET {} FROM statistics_histograms AS h WHERE h.entity_type = %s AND h.metric = %s AND h.entity_id = t.{} AND {}").format(sql.Identifier(table), sql.SQL(', ').join(set_columns), sql.Identifier(facet_spec['key_column']), key_condition), params + [facet_spec['entity_type'], metric] + key_params)
+
+                db.commit()
+
+        self.logger.info("Derived %s of %s from monthly histograms.", metric, table)
+
+    def write_histogram_rows(self, cursor=None, rows=None, entity_type=None, **_kwargs):
+        """Write (id, metric, (first month, count before, monthly counts)) rows of a page"""
+
+        cursor.executemany("INSERT INTO statistics_histograms (entity_type, entity_id, metric, first_month, before_count, month_counts) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (entity_type, entity_id, metric) DO UPDATE SET first_month = EXCLUDED.first_month, before_count = EXCLUDED.before_count, month_counts = EXCLUDED.month_counts", [(entity_type, entity_id, metric, first_month, before_count, month_counts) for entity_id, metric, (first_month, before_count, month_counts) in rows])
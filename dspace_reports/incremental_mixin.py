@@ -0,0 +1,193 @@
+"""Indexer methods for incremental views and downloads"""
+
+import math
+
+from datetime import date, datetime, timedelta, timezone
+from psycopg import sql
+
+from lib.database import Database
+
+
+class IncrementalMixin():
+    """Indexer methods for adding the documents since the last run to the daily store
+
+    The time up to which each facet spec was added is kept in statistics_watermarks.
+    """
+
+    def index_facet_incremental(self, facet_spec=None):
+        """Add the documents since the watermark to the daily store and derive the time periods"""
+
+        if facet_spec is None:
+            return
+
+        phase = facet_spec['phase']
+        if self.is_phase_completed(phase=phase, time_period='incremental'):
+            return
+
+        store = self.get_daily_store(facet_spec=facet_spec)
+        if store is None:
+            return
+
+        # Get Solr shards
+        shards = self.solr.get_statistics_shards()
+
+        watermark = self.get_watermark(phase=phase)
+        if watermark is None:
+            # The first run stores the counts before the daily store as its base counts and
+            # adds every day again, so days filled before are cleared
+            watermark = datetime.combine(store.first_day, datetime.min.time())
+            store.clear_days(start_day=store.first_day, end_day=date.today() + timedelta(days=1))
+            self.logger.info("Setting base counts of daily store %s.", phase)
+            store.set_base(*self.fetch_facet_counts(facet_spec=facet_spec, shards=shards,
+                                                    time_end=watermark))
+
+        # Recent documents are left for the next run as Solr may still be receiving them
+        new_watermark = (datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0) -
+                         timedelta(minutes=self.incremental_lag_minutes))
+
+        # Days are recounted as a whole from the start of the day of the watermark, so a
+        # run interrupted between writing the store and saving the watermark does not count
+        # documents twice
+        chunk_start = datetime.combine(watermark.date(), datetime.min.time())
+        while chunk_start < new_watermark:
+            chunk_end = min(datetime.combine(
+                chunk_start.date() + timedelta(days=self.daily_store_chunk_days),
+                datetime.min.time()), new_watermark)
+            self.logger.info("Counting %s since %s until %s.", phase, chunk_start.isoformat(),
+                             chunk_end.isoformat())
+
+            # The last day of the chunk may be partial and is recounted by the next run
+            end_day = chunk_end.date()
+            if chunk_end.time() != datetime.min.time():
+                end_day = end_day + timedelta(days=1)
+            store.clear_days(start_day=chunk_start.date(), end_day=end_day)
+            for uuids, counts in self.fetch_daily_counts(facet_spec=facet_spec, shards=shards,
+                                                         time_start=chunk_start,
+                                                         time_end=chunk_end):
+                store.set_counts(uuids=uuids, start_day=chunk_start.date(), counts=counts)
+
+            # The store is written before the watermark moves past the counted documents
+            store.flush(filled_until=chunk_end.date())
+            self.save_watermark(phase=phase, watermark=chunk_end)
+            chunk_start = chunk_end
+
+        self.write_daily_store_windows(facet_spec=facet_spec, store=store)
+
+    def fetch_facet_counts(self, facet_spec=None, shards=None, time_end=None):
+        """Get the UUIDs and total counts of the documents before time_end"""
+
+        facet_field = facet_spec['facet_field']
+
+        # Create base Solr url
+        solr_url = self.solr_server + "/statistics/select"
+
+        query = (f"type:{facet_spec['type']} AND {facet_field}:/.{{36}}/ AND " +
+                 f"time:[* TO {time_end.isoformat()}Z}}")
+
+        uuids = []
+        counts = []
+        results_total_num_facets = self.get_facet_count(facet_spec=facet_spec, query=query,
+                                                        shards=shards)
+        if results_total_num_facets is None:
+            return uuids, counts
+
+        results_per_page = self.facet_page_size
+        for results_current_page in range(math.ceil(results_total_num_facets /
+                                                     results_per_page)):
+            solr_query_params = {
+                "q": query,
+                "fq": facet_spec['filters'],
+                "facet": "true",
+                "facet.field": facet_field,
+                "facet.mincount": 1,
+                "facet.limit": results_per_page,
+                "facet.offset": results_current_page * results_per_page,
+                "facet.sort": "index",
+                "shards": shards,
+                "rows": 0,
+                "wt": "json",
+                "json.nl": "map",
+            }
+
+            response = self.solr.call(url=solr_url, params=solr_query_params)
+            self.logger.debug("Solr %s counts query: %s", facet_spec['phase'], response.url)
+
+            facets = response.json()["facet_counts"]["facet_fields"]
+            for uuid, count in facets[facet_field].items():
+                if len(uuid) == 36:
+                    uuids.append(uuid)
+                    counts.append(count)
+
+        return uuids, counts
+
+    def write_daily_store_windows(self, facet_spec=None, store=None):
+        """Set the time period columns of a facet spec from the daily store"""
+
+        metric = facet_spec['metric']
+        table = facet_spec['table']
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                for time_period in self.time_periods:
+                    date_range = self.get_date_range(time_period)
+                    if len(date_range) != 2 or None in date_range:
+                        self.logger.error("Error creating date range.")
+                        continue
+
+                    # An open start is all time, including the base counts of the store
+                    start_day = store.first_day
+                    if date_range[0] != '*':
+                        start_day = date.fromisoformat(date_range[0][0:10])
+
+                    # Days end at midnight, a later end time includes its day
+                    end_day = date.fromisoformat(date_range[1][0:10])
+                    if date_range[1][11:19] != '00:00:00':
+                        end_day = end_day + timedelta(days=1)
+
+                    uuids, sums = store.window_sums(start_day=start_day, end_day=end_day,
+                                                    include_base=date_range[0] == '*')
+                    rows = list(zip(uuids, sums.tolist()))
+
+                    # Entities without documents in the daily store stay at 0
+                    column = sql.Identifier(self.get_period_column(metric, time_period))
+                    key_condition, key_params = self.get_key_condition(
+                        facet_spec)
+                    cursor.execute(sql.SQL("UPDATE {} SET {} = 0 WHERE {}").format(
+                        sql.Identifier(table), column, key_condition), key_params)
+                    cursor.executemany(sql.SQL("UPDATE {} SET {} = %s WHERE {} = %s").format(
+                        sql.Identifier(table), column, sql.Identifier(facet_spec['key_column'])),
+                        [(value, uuid) for uuid, value in rows if value > 0])
+
+                    self.save_history(writer=cursor, entity_type=facet_spec['entity_type'],
+                                      metric=metric, date_range=date_range,
+                                      rows=[(uuid, value) for uuid, value in rows if value > 0])
+
+                # Record the finished phase with its results
+                self.save_checkpoint(writer=cursor, phase=facet_spec['phase'],
+                                     time_period='incremental', completed=True)
+
+                self.commit_checkpoints(connection=db)
+
+        self.logger.info("Updated %s of %s from the daily store.", metric, table)
+
+    def get_watermark(self, phase=None):
+        """Get the time up to which a phase was added to the daily store"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT watermark FROM statistics_watermarks WHERE phase = %s",
+                               (phase,))
+                row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def save_watermark(self, phase=None, watermark=None):
+        """Save the time up to which a phase was added to the daily store"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("INSERT INTO statistics_watermarks (phase, watermark, updated_at) VALUES (%s, %s, now()) ON CONFLICT (phase) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at", (phase, watermark))
+                db.commit()
@@ -1,23 +1,56 @@
 """Base indexer class"""
 
+import json
 import logging
+import math
+import os
+import queue
 import sys
+import threading
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
+from time import sleep
 from dateutil.relativedelta import relativedelta
+from psycopg import sql
 
 from lib.api import DSpaceRestApi
+from lib.database import Database
 from lib.solr import DSpaceSolr
+from dspace_reports.daily_store_mixin import DailyStoreMixin
+from dspace_reports.histogram_mixin import HistogramMixin
+from dspace_reports.incremental_mixin import IncrementalMixin
 
-class Indexer():
-    """Base indexer class"""
+class Indexer(HistogramMixin, DailyStoreMixin, IncrementalMixin):
+    """Base indexer class
 
-    def __init__(self, config=None, logger=None):
+    The histogram, daily store and incremental modes of index_facets() are in the mixins.
+    """
+
+    # Views and downloads facet specs of the indexed entities, see index_facet()
+    facet_specs = []
+
+    # Key of the UUIDs of the indexed entities in a scope, if they are known from it
+    scope_key = None
+
+    def __init__(self, config=None, logger=None, checkpoints=None, rest=None, solr=None):
         if config is None:
             print("ERROR: A configuration file required to create the stats indexer.")
             sys.exit(1)
 
         self.config = config
+
+        # Optionally let the indexing session commit without waiting for the WAL flush
+        if config.get('indexing_synchronous_commit'):
+            self.config = dict(config)
+            self.config['statistics_db'] = dict(config['statistics_db'])
+            self.config['statistics_db']['synchronous_commit'] = (
+                config['indexing_synchronous_commit'])
+
+        # Copy of the class facet specs, which a scope or a partition may change
+        self.facet_specs = list(self.facet_specs)
+
         self.base_url = config['dspace_server'] + '/handle/'
         self.solr_server = config['solr_server']
 
@@ -27,15 +60,21 @@ class Indexer():
         else:
             self.logger = logging.getLogger('dspace-reports')
 
-        # Create REST API object
-        self.rest = DSpaceRestApi(rest_server=config['rest_server'])
+        # Use the shared REST API object, or create one
+        if rest is not None:
+            self.rest = rest
+        else:
+            self.rest = DSpaceRestApi(rest_server=config['rest_server'])
         if self.rest is None:
             self.logger.error("Unable to create Indexer due to earlier failures creating a " +
                               "connection to the REST API.")
             sys.exit(1)
 
-        # Create Solr server object
-        self.solr = DSpaceSolr(solr_server=config['solr_server'])
+        # Use the shared Solr server object, or create one
+        if solr is not None:
+            self.solr = solr
+        else:
+            self.solr = DSpaceSolr(solr_server=config['solr_server'])
         if self.solr is None:
             self.logger.error("Unable to create Indexer due to earlier failures creating a " +
                               "connection to Solr.")
@@ -44,6 +83,52 @@ class Indexer():
         # The time periods used to generate statistical reports
         self.time_periods = ['month', 'year', 'all']
 
+        # Number of threads fetching facet pages from Solr and the number of fetched pages
+        # that may wait for the database writer
+        self.solr_workers = config.get('solr_workers', 2)
+        self.write_queue_size = config.get('write_queue_size', 10)
+
+        # Compute collection and community views and downloads from item statistics
+        # instead of separate Solr facet scans
+        self.sql_rollups = config.get('sql_rollups', False)
+
+        # Also keep every value in the long-format statistics history
+        self.record_history = config.get('record_history', False)
+
+        # Seconds to wait after each Solr facet page
+        self.delay = 0
+
+        # Number of facet values fetched per Solr request
+        self.facet_page_size = 100
+
+        # Fetch monthly counts per facet value instead of one scan per time period
+        self.histogram_mode = config.get('histogram_mode', False)
+        self.histogram_start = config.get('histogram_start', '2000-01')
+
+        # Keep daily counts per facet value in a local memory-mapped store
+        self.daily_store = config.get('daily_store', False)
+        self.daily_store_dir = config.get('daily_store_dir') or os.path.join(config['work_dir'],
+                                                                            'daily-store')
+        self.daily_store_start = config.get('daily_store_start', '2020-01-01')
+        self.daily_store_chunk_days = config.get('daily_store_chunk_days', 31)
+
+        # Only add the documents since the last run to the daily store, leaving the
+        # documents of the last minutes for the next run
+        self.incremental = config.get('incremental', False)
+        self.incremental_lag_minutes = config.get('incremental_lag_minutes', 60)
+
+        # Communities and collections of the subtrees the indexer is limited to, if any,
+        # and the UUIDs of the rows it may write
+        self.scope = None
+        self.scope_ids = None
+
+        # Progress of the indexing run this indexer is part of, if any
+        self.checkpoints = checkpoints
+
+        # Commit queued writes every N statements or every T seconds, whichever comes first
+        self.commit_batch_size = config.get('commit_batch_size', 1000)
+        self.commit_interval = config.get('commit_interval', 0)
+
     def index(self):
         """Index function"""
 
@@ -57,6 +142,14 @@ class Indexer():
             self.logger.debug("time_period of none given to get_date_range() method.")
             return date_range
 
+        # A resumed run keeps using the date ranges it started with
+        if self.checkpoints is not None:
+            checkpoint_date_range = self.checkpoints.get_date_range(time_period)
+            if checkpoint_date_range is not None:
+                self.logger.info("Using date range of resumed run: %s - %s",
+                                 checkpoint_date_range[0], checkpoint_date_range[1])
+                return checkpoint_date_range
+
         if time_period == 'month':
             self.logger.info("Getting stats for last month.")
             dt = date.today()
@@ -94,3 +187,643 @@ class Indexer():
 
         self.logger.debug("Date range has %s dates.", len(date_range))
         return date_range
+
+    def get_period_column(self, metric=None, time_period=None):
+        """Get the statistics table column of a metric for a time period"""
+
+        if time_period == 'month':
+            return metric + '_last_month'
+        if time_period == 'year':
+            return metric + '_academic_year'
+
+        return metric + '_total'
+
+    def index_item_counts(self, facet_field=None, entity_type=None, table=None,
+                          key_column=None, writer=None):
+        """Index the item counts of all collections or communities with one faceted query"""
+
+        if facet_field is None or table is None or key_column is None or writer is None:
+            return
+
+        # Create base Solr URL
+        solr_url = self.solr_server + "/search/select"
+
+        # One terms facet per time period, each limited to the items accessioned in it
+        date_ranges = {}
+        json_facet = {}
+        for time_period in self.time_periods:
+            date_range = self.get_date_range(time_period)
+            if len(date_range) != 2 or None in date_range:
+                self.logger.error("Error creating date range.")
+                continue
+
+            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
+            date_ranges[time_period] = date_range
+            json_facet[time_period] = {
+                "type": "terms",
+                "field": facet_field,
+                "limit": -1,
+                "mincount": 1,
+                "domain": {
+                    "filter": f"dc.date.accessioned_dt:[{date_range[0]} TO {date_range[1]}]"
+                }
+            }
+
+        solr_query_params = {
+            "q": "search.resourcetype:Item",
+            "rows": 0,
+            "wt": "json",
+            "json.facet": json.dumps(json_facet)
+        }
+        if self.scope is not None:
+            solr_query_params['fq'] = self.get_scope_filter(community_field='location.comm',
+                                                            collection_field='location.coll')
+
+        # Make call to Solr for the item counts of every time period
+        response = self.solr.call(url=solr_url, params=solr_query_params)
+        self.logger.info("Calling Solr item counts of %s: %s", table, response.url)
+
+        try:
+            facets = response.json()["facets"]
+        except (TypeError, KeyError):
+            self.logger.error("Unable to get item counts of %s from Solr.", table)
+            return
+
+        for time_period, date_range in date_ranges.items():
+            buckets = facets.get(time_period, {}).get("buckets", [])
+            rows = self.filter_scope_rows(rows=[(bucket["val"], bucket["count"])
+                                                for bucket in buckets])
+            self.logger.info("Solr - %s %s with items in time period %s.", str(len(rows)),
+                             table, time_period)
+
+            # Entities without items in the time period are not in the facet
+            column = self.get_period_column('items', time_period)
+            key_condition, key_params = self.get_key_condition({'key_column': key_column})
+            writer.execute(sql.SQL("UPDATE {} SET {} = 0 WHERE {}").format(
+                sql.Identifier(table), sql.Identifier(column), key_condition), key_params)
+            writer.executemany(sql.SQL("UPDATE {} SET {} = %s WHERE {} = %s").format(
+                sql.Identifier(table), sql.Identifier(column), sql.Identifier(key_column)),
+                [(count, uuid) for uuid, count in rows])
+
+            self.save_history(writer=writer, entity_type=entity_type, metric='items',
+                              date_range=date_range, rows=rows)
+
+    def get_key_condition(self, facet_spec=None, table_alias=None):
+        """Get the SQL condition and parameters limiting the rows written for a facet spec
+
+        A facet spec of a partitioned indexer has a 'key_range' of the first and the
+        following (None for the last partition) leading UUID characters of its rows. An
+        indexer limited to a subtree only writes the rows of its scope_ids. The key column
+        is qualified with table_alias if given.
+        """
+
+        if table_alias is not None:
+            key_column = sql.Identifier(table_alias, facet_spec['key_column'])
+        else:
+            key_column = sql.Identifier(facet_spec['key_column'])
+        conditions = []
+        params = []
+
+        key_range = facet_spec.get('key_range')
+        if key_range is not None:
+            conditions.append(sql.SQL("{}::text >= %s").format(key_column))
+            params.append(key_range[0])
+            if key_range[1] is not None:
+                conditions.append(sql.SQL("{}::text < %s").format(key_column))
+                params.append(key_range[1])
+
+        if self.scope_ids is not None:
+            conditions.append(sql.SQL("{}::text = ANY(%s)").format(key_column))
+            params.append(sorted(self.scope_ids))
+
+        if len(conditions) == 0:
+            return sql.SQL("TRUE"), []
+
+        return sql.SQL(" AND ").join(conditions), params
+
+    def set_scope(self, identifiers=None):
+        """Limit the indexer to the subtrees of community or collection UUIDs or handles"""
+
+        scope = self.resolve_scope(identifiers=identifiers)
+        if scope is None:
+            self.logger.error("Unable to find the communities and collections to index.")
+            sys.exit(1)
+
+        self.scope = scope
+        self.logger.info("Indexing %s communities and %s collections.",
+                         str(len(scope['communities'])), str(len(scope['collections'])))
+
+        # The daily store and its watermarks cover the whole repository
+        if self.daily_store or self.incremental:
+            self.logger.info("Not updating the daily store for a subtree.")
+            self.daily_store = False
+            self.incremental = False
+
+        # Only count statistics documents of the subtree and only write its rows
+        scope_filter = self.get_scope_filter(community_field='owningComm',
+                                             collection_field='owningColl')
+        self.facet_specs = [dict(facet_spec, filters=facet_spec['filters'] + " AND " +
+                                 scope_filter) for facet_spec in self.facet_specs]
+        if self.scope_key is not None:
+            self.scope_ids = set(scope[self.scope_key])
+
+    def resolve_scope(self, identifiers=None):
+        """Find the communities and collections in the subtrees of UUIDs or handles
+
+        Returns a dict with the UUIDs of the given 'roots' and of all 'communities' and
+        'collections' in their subtrees, or None.
+        """
+
+        if not identifiers:
+            return None
+
+        # Create base Solr URL
+        solr_url = self.solr_server + "/search/select"
+
+        uuids = [identifier for identifier in identifiers if len(identifier) == 36]
+        handles = [identifier for identifier in identifiers if len(identifier) != 36]
+        conditions = []
+        if len(uuids) > 0:
+            conditions.append("search.resourceid:(" + " OR ".join(uuids) + ")")
+        if len(handles) > 0:
+            conditions.append("handle:(" + " OR ".join(f'"{handle}"' for handle in handles) +
+                              ")")
+
+        roots = self.find_scope_objects(solr_url=solr_url,
+                                        query=" OR ".join(conditions))
+        if roots is None or len(roots['communities']) + len(roots['collections']) == 0:
+            return None
+
+        scope = {
+            'roots': roots,
+            'communities': list(roots['communities']),
+            'collections': list(roots['collections'])
+        }
+
+        # Communities and collections are indexed with the locations of all parents
+        if len(roots['communities']) > 0:
+            subtree = self.find_scope_objects(
+                solr_url=solr_url,
+                query="location.comm:(" + " OR ".join(roots['communities']) + ")")
+            if subtree is None:
+                return None
+
+            for key in ['communities', 'collections']:
+                scope[key] = sorted(set(scope[key]) | set(subtree[key]))
+
+        return scope
+
+    def find_scope_objects(self, solr_url=None, query=None):
+        """Get the UUIDs of the communities and collections matching a search query"""
+
+        solr_query_params = {
+            "q": "search.resourcetype:(Community OR Collection) AND (" + query + ")",
+            "fl": "search.resourceid,search.resourcetype",
+            "rows": 100000,
+            "wt": "json"
+        }
+
+        response = self.solr.call(url=solr_url, params=solr_query_params)
+        self.logger.info("Calling Solr communities and collections: %s", response.url)
+
+        try:
+            docs = response.json()["response"]["docs"]
+        except (TypeError, KeyError):
+            self.logger.error("Unable to find communities and collections in Solr.")
+            return None
+
+        objects = {'communities': [], 'collections': []}
+        for doc in docs:
+            key = 'communities' if doc['search.resourcetype'] == 'Community' else 'collections'
+            objects[key].append(doc['search.resourceid'])
+
+        return objects
+
+    def get_scope_filter(self, community_field=None, collection_field=None):
+        """Get the Solr filter of documents in the subtrees of the scope"""
+
+        conditions = []
+        if len(self.scope['roots']['communities']) > 0:
+            conditions.append(f"{community_field}:(" +
+                              " OR ".join(self.scope['roots']['communities']) + ")")
+        if len(self.scope['roots']['collections']) > 0:
+            conditions.append(f"{collection_field}:(" +
+                              " OR ".join(self.scope['roots']['collections']) + ")")
+
+        return "(" + " OR ".join(conditions) + ")"
+
+    def filter_scope_rows(self, rows=None):
+        """Keep the rows of entities in the scope of the indexer"""
+
+        if self.scope_ids is None:
+            return rows
+
+        return [row for row in rows if row[0] in self.scope_ids]
+
+    def index_facets(self, facet_specs=None):
+        """Index the statistics of all facet specs for every time period"""
+
+        if facet_specs is None:
+            facet_specs = []
+
+        # New documents are added to the daily store and every time period is derived from it
+        if self.incremental:
+            for facet_spec in facet_specs:
+                self.logger.info("Updating %s statistics for %s incrementally.",
+                                 facet_spec['metric'], facet_spec['table'])
+                self.index_facet_incremental(facet_spec=facet_spec)
+            return
+
+        # Monthly counts are fetched once and every time period is derived from them
+        if self.histogram_mode:
+            for facet_spec in facet_specs:
+                self.logger.info("Updating %s histograms for %s.", facet_spec['metric'],
+                                 facet_spec['table'])
+                self.index_facet_histogram(facet_spec=facet_spec)
+        else:
+            for time_period in self.time_periods:
+                for facet_spec in facet_specs:
+                    self.logger.info("Updating %s statistics for %s during time period: %s",
+                                     facet_spec['metric'], facet_spec['table'], time_period)
+                    self.index_facet(facet_spec=facet_spec, time_period=time_period)
+
+        # Add the days since the last run to the local daily store
+        if self.daily_store:
+            for facet_spec in facet_specs:
+                self.update_daily_store(facet_spec=facet_spec)
+
+    def index_facet(self, facet_spec=None, time_period=None, pages=None):
+        """Index one facet spec: count the distinct facet values, then page through them
+
+        A facet spec is a dict with the keys:
+            phase: checkpoint phase, e.g. 'item_views'
+            metric: 'views' or 'downloads'
+            entity_type: entity type of the statistics history
+            facet_field: Solr statistics field holding the entity UUID, e.g. 'owningItem'
+            type: DSpace object type of the statistics documents
+            filters: Solr filter query, e.g. bot and bundle filters
+            table: statistics table to update
+            key_column: UUID column of the statistics table
+
+        With pages, only that range of facet pages is indexed and the values are not
+        counted first.
+        """
+
+        if facet_spec is None or time_period is None:
+            return
+
+        phase = facet_spec['phase']
+        facet_field = facet_spec['facet_field']
+
+        if self.is_phase_completed(phase=phase, time_period=time_period):
+            return
+
+        # Create base Solr url
+        solr_url = self.solr_server + "/statistics/select"
+
+        # Get Solr shards
+        shards = self.solr.get_statistics_shards()
+
+        # Query and filters shared by the count and the page requests
+        query, date_range = self.get_facet_query(facet_spec=facet_spec, time_period=time_period)
+
+        # Divide results into "pages" and round up to next integer
+        results_per_page = self.facet_page_size
+        if pages is None:
+            results_num_pages = self.count_facet_pages(facet_spec=facet_spec, query=query,
+                                                       shards=shards)
+            if results_num_pages is None:
+                return
+            pages = range(0, results_num_pages)
+        results_num_pages = pages.stop - 1
+        results_first_page = max(pages.start,
+                                 self.get_facet_offset(phase=phase, time_period=time_period))
+
+        def fetch_page(results_current_page):
+            """Fetch a page of facet values from Solr"""
+
+            print(
+                f"Indexing {phase} (page {results_current_page + 1} " +
+                f"of {results_num_pages + 1})"
+            )
+
+            # Solr params for current page
+            solr_query_params = {
+                "q": query,
+                "fq": facet_spec['filters'],
+                "fl": facet_field,
+                "facet": "true",
+                "facet.field": facet_field,
+                "facet.mincount": 1,
+                "facet.limit": results_per_page,
+                "facet.offset": results_current_page * results_per_page,
+                "facet.sort": "index",
+                "shards": shards,
+                "rows": 0,
+                "wt": "json",
+                "json.nl": "map",
+            }
+
+            response = self.solr.call(url=solr_url, params=solr_query_params)
+            self.logger.info("Solr %s query: %s", phase, response.url)
+
+            if self.delay:
+                sleep(self.delay)
+
+            # Solr returns facets as a dict of dicts (see json.nl parameter)
+            facets = response.json()["facet_counts"]["facet_fields"]
+            # Iterate over the facetField dict and get the UUIDs and counts
+            rows = []
+            for uuid, count in facets[facet_field].items():
+                if len(uuid) == 36:
+                    rows.append((uuid, facet_spec['metric'], count))
+                else:
+                    self.logger.warning("%s value is not a UUID: %s", facet_field, uuid)
+
+            return rows
+
+        # Fetch pages from Solr while the previous pages are written to the database
+        self.run_facet_pipeline(phase=phase, time_period=time_period, date_range=date_range,
+                                pages=range(results_first_page, pages.stop),
+                                fetch_page=fetch_page, entity_type=facet_spec['entity_type'],
+                                table=facet_spec['table'], key_column=facet_spec['key_column'])
+
+    def get_facet_query(self, facet_spec=None, time_period=None):
+        """Get the Solr query and the date range of a facet spec in a time period"""
+
+        query = f"type:{facet_spec['type']} AND {facet_spec['facet_field']}:/.{{36}}/"
+
+        # Get date range for Solr query if time period is specified
+        date_range = self.get_date_range(time_period)
+        if len(date_range) == 2:
+            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
+            if date_range[0] is not None and date_range[1] is not None:
+                query = query + f" AND time:[{date_range[0]} TO {date_range[1]}]"
+        else:
+            self.logger.error("Error creating date range.")
+
+        return query, date_range
+
+    def count_facet_pages(self, facet_spec=None, query=None, shards=None, time_period=None):
+        """Get the number of facet pages of a facet spec"""
+
+        if query is None:
+            query, _ = self.get_facet_query(facet_spec=facet_spec, time_period=time_period)
+        if shards is None:
+            shards = self.solr.get_statistics_shards()
+
+        results_total_num_facets = self.get_facet_count(facet_spec=facet_spec, query=query,
+                                                        shards=shards)
+        if results_total_num_facets is None:
+            return None
+
+        # The last page is requested even if the values fill the pages before it
+        return math.ceil(results_total_num_facets / self.facet_page_size) + 1
+
+    def get_facet_count(self, facet_spec=None, query=None, shards=None):
+        """Get the number of distinct facet values of a facet spec"""
+
+        facet_field = facet_spec['facet_field']
+
+        # Create base Solr url
+        solr_url = self.solr_server + "/statistics/select"
+
+        solr_query_params = {
+            "q": query,
+            "fq": facet_spec['filters'],
+            "fl": facet_field,
+            "facet": "true",
+            "facet.field": facet_field,
+            "facet.mincount": 1,
+            "facet.limit": 1,
+            "facet.offset": 0,
+            "stats": "true",
+            "stats.field": facet_field,
+            "stats.calcdistinct": "true",
+            "shards": shards,
+            "rows": 0,
+            "wt": "json",
+        }
+
+        # Make call to Solr for the number of distinct facet values
+        response = self.solr.call(url=solr_url, params=solr_query_params)
+        self.logger.info("Calling Solr total %s: %s", facet_spec['phase'], response.url)
+
+        try:
+            # Get total number of distinct facets (countDistinct)
+            return response.json()["stats"]["stats_fields"][facet_field]["countDistinct"]
+        except TypeError:
+            self.logger.info("No %s to index.", facet_spec['phase'])
+            return None
+
+    def run_facet_pipeline(self, phase=None, time_period=None, date_range=None, pages=None,
+                           fetch_page=None, entity_type=None, table=None, key_column=None,
+                           write_rows=None):
+        """Fetch facet pages from Solr in worker threads while a writer thread stores them"""
+
+        if pages is None or fetch_page is None or table is None or key_column is None:
+            return
+
+        if write_rows is None:
+            write_rows = self.write_facet_rows
+
+        # Pages wait here for the writer. The bounded size stops fetching from running far
+        # ahead of the database.
+        write_queue = queue.Queue(maxsize=self.write_queue_size)
+        writer_errors = []
+        writer = threading.Thread(target=self.write_facet_pages,
+                                  args=(write_queue, writer_errors, phase, time_period,
+                                        date_range, entity_type, table, key_column, write_rows))
+        writer.start()
+
+        completed = False
+        try:
+            with ThreadPoolExecutor(max_workers=self.solr_workers) as executor:
+                # Pages are handed to the writer in order so that the checkpoint of the
+                # phase always points at the first page that has not been written
+                pending = deque()
+                writer_running = True
+                for page in pages:
+                    if len(writer_errors) > 0 or not writer_running:
+                        break
+                    pending.append((page, executor.submit(fetch_page, page)))
+                    if len(pending) >= self.solr_workers:
+                        pending_page, future = pending.popleft()
+                        writer_running = self.put_facet_page(
+                            write_queue=write_queue, writer=writer,
+                            item=(pending_page, future.result()))
+
+                while len(pending) > 0 and len(writer_errors) == 0 and writer_running:
+                    pending_page, future = pending.popleft()
+                    writer_running = self.put_facet_page(write_queue=write_queue, writer=writer,
+                                                         item=(pending_page, future.result()))
+
+                # Pages that were not handed to the writer are fetched again on resume
+                for _, future in pending:
+                    future.cancel()
+
+            completed = len(writer_errors) == 0 and writer_running
+        finally:
+            # Tell the writer there are no more pages
+            self.put_facet_page(write_queue=write_queue, writer=writer, item=(None, completed))
+            writer.join()
+
+        if len(writer_errors) > 0:
+            raise writer_errors[0]
+        if not completed:
+            raise RuntimeError(f"Writer of {phase} stopped before all pages were written.")
+
+    def write_facet_pages(self, write_queue=None, writer_errors=None, phase=None,
+                          time_period=None, date_range=None, entity_type=None, table=None,
+                          key_column=None, write_rows=None):
+        """Write queued rows of facet pages to the database"""
+
+        page = 0
+        try:
+            with Database(self.config['statistics_db']) as db:
+                with db.cursor() as cursor:
+                    while True:
+                        page, rows = write_queue.get()
+
+                        if page is None:
+                            # All pages were written if the fetching finished
+                            if rows:
+                                self.save_checkpoint(writer=cursor, phase=phase,
+                                                     time_period=time_period,
+                                                     date_range=date_range, completed=True)
+                                self.commit_checkpoints(connection=db)
+                            return
+
+                        try:
+                            write_rows(cursor=cursor, rows=self.filter_scope_rows(rows=rows),
+                                       time_period=time_period, date_range=date_range,
+                                       entity_type=entity_type, table=table,
+                                       key_column=key_column)
+
+                            # Record the next page to index along with the writes of this page
+                            self.save_checkpoint(writer=cursor, phase=phase,
+                                                 time_period=time_period, date_range=date_range,
+                                                 facet_offset=page + 1)
+                            self.commit_checkpoints(connection=db)
+                        except Exception:
+                            self.rollback_checkpoints(connection=db)
+                            raise
+
+                        self.logger.debug("Wrote %s rows of page %s to %s.", str(len(rows)),
+                                          str(page + 1), table)
+        except Exception as err: # pylint: disable=broad-exception-caught
+            self.logger.error("Error writing facet page to %s: %s", table, err)
+            writer_errors.append(err)
+
+            # Keep emptying the queue until the last page so fetching never blocks
+            while page is not None:
+                page, _ = write_queue.get()
+
+    def put_facet_page(self, write_queue=None, writer=None, item=None):
+        """Hand a page to the writer thread, returning False if the writer has stopped"""
+
+        while True:
+            try:
+                write_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                if not writer.is_alive():
+                    return False
+
+    def write_facet_rows(self, cursor=None, rows=None, time_period=None, date_range=None,
+                         entity_type=None, table=None, key_column=None):
+        """Write (id, metric, value) rows of a facet page to the time period columns"""
+
+        for metric in sorted({row[1] for row in rows}):
+            metric_rows = [(entity_id, value) for entity_id, row_metric, value
+                           in rows if row_metric == metric]
+            query = sql.SQL("UPDATE {} SET {} = %s WHERE {} = %s").format(
+                sql.Identifier(table),
+                sql.Identifier(self.get_period_column(metric, time_period)),
+                sql.Identifier(key_column))
+            cursor.executemany(query, [(value, entity_id) for entity_id, value
+                                       in metric_rows])
+            self.save_history(writer=cursor, entity_type=entity_type,
+                              metric=metric, date_range=date_range,
+                              rows=metric_rows)
+
+    def save_history(self, writer=None, entity_type=None, metric=None, date_range=None,
+                     rows=None):
+        """Record (entity ID, value) rows of a metric in the long-format statistics history"""
+
+        # History rows belong to an indexing run
+        if not self.record_history or self.checkpoints is None or not rows:
+            return
+
+        if date_range is None or len(date_range) != 2:
+            self.logger.error("Unable to record history without a date range.")
+            return
+
+        # Periods are stored as dates, an open start means all time
+        period_start = '-infinity'
+        if date_range[0] != '*':
+            period_start = date_range[0][0:10]
+        period_end = date_range[1][0:10]
+
+        writer.executemany("INSERT INTO statistics_facts (entity_type, entity_id, metric, period_start, period_end, value, run_id) VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT (entity_type, entity_id, metric, period_start, period_end, run_id) DO UPDATE SET value = EXCLUDED.value", [(entity_type, entity_id, metric, period_start, period_end, value, self.checkpoints.run_id) for entity_id, value in rows])
+
+    def is_phase_completed(self, phase=None, time_period=''):
+        """Check if a phase was already completed by a resumed run"""
+
+        if self.checkpoints is None:
+            return False
+
+        if self.checkpoints.is_completed(phase=phase, time_period=time_period):
+            self.logger.info("Skipping completed phase: %s %s", phase, time_period)
+            return True
+
+        return False
+
+    def get_facet_offset(self, phase=None, time_period=''):
+        """Get the facet page to continue a phase from"""
+
+        if self.checkpoints is None:
+            return 0
+
+        return self.checkpoints.get_facet_offset(phase=phase, time_period=time_period)
+
+    def save_checkpoint(self, writer=None, phase=None, time_period='', date_range=None,
+                        facet_offset=0, completed=False):
+        """Save the progress of a phase along with its writes"""
+
+        if self.checkpoints is None:
+            return
+
+        self.checkpoints.save(writer=writer, phase=phase, time_period=time_period,
+                              date_range=date_range, facet_offset=facet_offset,
+                              completed=completed)
+
+    def complete_phase(self, phase=None, time_period='', date_range=None):
+        """Mark a phase as completed in its own transaction"""
+
+        if self.checkpoints is None:
+            return
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                self.save_checkpoint(writer=cursor, phase=phase, time_period=time_period,
+                                     date_range=date_range, completed=True)
+                self.commit_checkpoints(connection=db)
+
+    def commit_checkpoints(self, connection=None):
+        """Commit the writes of a phase, after which this run uses their checkpoints"""
+
+        if self.checkpoints is None:
+            connection.commit()
+            return
+
+        self.checkpoints.commit(connection=connection)
+
+    def rollback_checkpoints(self, connection=None):
+        """Roll back the writes of a phase along with their checkpoints"""
+
+        if self.checkpoints is None:
+            connection.rollback()
+            return
+
+        self.checkpoints.rollback(connection=connection)
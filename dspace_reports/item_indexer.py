@@ -1,17 +1,44 @@
 """Class for indexing items"""
 
-import math
-from time import sleep
+import sys
 
-from lib.database import Database
+from lib.database import BatchWriter, Database
 from dspace_reports.indexer import Indexer
 
 
 class ItemIndexer(Indexer):
     """Class for indexing items"""
 
-    def __init__(self, config, logger):
-        super().__init__(config, logger)
+    # Solr facets of the item views and downloads
+    facet_specs = [
+        {
+            'phase': 'item_views',
+            'metric': 'views',
+            'entity_type': 'item',
+            'facet_field': 'id',
+            'type': 2,
+            'filters': "-isBot:true AND statistics_type:view",
+            'table': 'item_stats',
+            'key_column': 'item_id'
+        },
+        {
+            'phase': 'item_downloads',
+            'metric': 'downloads',
+            'entity_type': 'item',
+            'facet_field': 'owningItem',
+            'type': 0,
+            'filters': "-isBot:true AND statistics_type:view AND bundleName:ORIGINAL",
+            'table': 'item_stats',
+            'key_column': 'item_id'
+        }
+    ]
+
+    # Number of leading UUID characters the UUID space is partitioned by
+    partition_prefix_length = 3
+
+    def __init__(self, config, logger, checkpoints=None, rest=None, solr=None, partition=None,
+                 partitions=None):
+        super().__init__(config, logger, checkpoints, rest, solr)
 
         # Set time periods to only month and year as all can cause Solr to crash
         self.time_periods = ['month', 'year', 'all']
@@ -19,19 +46,148 @@ class ItemIndexer(Indexer):
         # Set crawl delay from config
         self.delay = config['delay']
 
+        # Number of items after which the progress of the items phase is saved
+        self.items_per_checkpoint = 100
+
+        # Index only one of several slices of the UUID space (partition 1 to partitions)
+        self.uuid_range = None
+        self.items_phase = 'items'
+        if partitions is not None and partitions > 1:
+            self.uuid_range = self.get_uuid_range(partition=partition, partitions=partitions)
+            self.logger.info("Indexing items %s of %s: UUIDs from %s to %s.", str(partition),
+                             str(partitions), self.uuid_range[0], self.uuid_range[1] or 'end')
+            self.items_phase = f"items_{partition}_of_{partitions}"
+
+            # Limit the Solr queries to the slice and keep the progress of every slice apart
+            lower, upper = self.uuid_range
+            self.facet_specs = []
+            for facet_spec in ItemIndexer.facet_specs:
+                uuid_filter = f"{facet_spec['facet_field']}:[{lower} TO {upper or '*'}}}"
+                self.facet_specs.append(dict(
+                    facet_spec,
+                    phase=f"{facet_spec['phase']}_{partition}_of_{partitions}",
+                    filters=facet_spec['filters'] + " AND " + uuid_filter,
+                    key_range=self.uuid_range))
+
+    def get_uuid_range(self, partition=None, partitions=None):
+        """Get the first and following (None for the last) leading UUID characters of a slice"""
+
+        if partition is None or partition < 1 or partition > partitions:
+            self.logger.error("Partition must be between 1 and %s.", str(partitions))
+            sys.exit(1)
+
+        prefixes = 16 ** self.partition_prefix_length
+        lower = format((partition - 1) * prefixes // partitions,
+                       f"0{self.partition_prefix_length}x")
+        upper = None
+        if partition < partitions:
+            upper = format(partition * prefixes // partitions,
+                           f"0{self.partition_prefix_length}x")
+
+        return lower, upper
+
+    def in_uuid_range(self, uuid=None):
+        """Check if a UUID belongs to the slice of this indexer"""
+
+        if self.uuid_range is None:
+            return True
+
+        lower, upper = self.uuid_range
+        prefix = uuid[0:self.partition_prefix_length].lower()
+        return prefix >= lower and (upper is None or prefix < upper)
+
+    def get_search_items(self):
+        """Get the items in the scope and UUID range from Solr and the REST API"""
+
+        # Create base Solr URL
+        solr_url = self.solr_server + "/search/select"
+
+        # Solr lists only the items of the subtrees and the UUID slice, so the REST API is
+        # only called for these items
+        filter_queries = []
+        if self.scope is not None:
+            filter_queries.append(self.get_scope_filter(community_field='location.comm',
+                                                        collection_field='location.coll'))
+        if self.uuid_range is not None:
+            lower, upper = self.uuid_range
+            filter_queries.append(f"search.resourceid:[{lower} TO {upper or '*'}}}")
+
+        item_uuids = []
+        rows = 1000
+        while True:
+            solr_query_params = {
+                "q": "search.resourcetype:Item",
+                "fq": filter_queries,
+                "fl": "search.resourceid",
+                "sort": "search.resourceid asc",
+                "start": len(item_uuids),
+                "rows": rows,
+                "wt": "json"
+            }
+
+            response = self.solr.call(url=solr_url, params=solr_query_params)
+            self.logger.info("Calling Solr items of subtree or partition: %s", response.url)
+
+            try:
+                docs = response.json()["response"]["docs"]
+            except (TypeError, KeyError):
+                self.logger.error("Unable to find the items of the subtree or partition in Solr.")
+                break
+
+            item_uuids.extend(doc['search.resourceid'] for doc in docs)
+            if len(docs) < rows:
+                break
+
+        items = []
+        for item_uuid in item_uuids:
+            item = self.rest.get_item(item_uuid=item_uuid)
+            if item is None or 'uuid' not in item:
+                self.logger.warning("Unable to get item %s from the REST API.", item_uuid)
+                continue
+            items.append(item)
+
+        return items
+
     def index(self):
-        # Get list of identifiers from REST API
-        items = self.rest.get_items()
+        """Index function"""
+
+        self.logger.info("Loading DSpace items...")
+        self.index_items()
+
+    def index_items(self, with_facets=True):
+        """Index the items in the repository"""
+
+        # Get list of identifiers from REST API, unless a resumed run already has them. The
+        # items of a subtree or a partition are looked up in Solr first.
+        items = []
+        if not self.is_phase_completed(phase=self.items_phase):
+            if self.scope is not None or self.uuid_range is not None:
+                items = self.get_search_items()
+            else:
+                items = self.rest.get_items()
+
+        # A partitioned indexer only writes the items of its own slice
+        items = [item for item in items if self.in_uuid_range(item['uuid'])]
+
+        # Only the views and downloads of these items are written for a subtree
+        if self.scope is not None:
+            self.scope_ids = {item['uuid'] for item in items}
+
         total_items = len(items)
         self.logger.info("Found %s records in REST API.", str(total_items))
 
-        # Keep a count of records that cannot be found by their metadata
-        count_items = 0
+        # Items are written in UUID order so a resumed run can skip the items it wrote
+        items.sort(key=lambda item: item['uuid'])
+        count_items = self.get_facet_offset(phase=self.items_phase)
+        if count_items > 0:
+            self.logger.info("Skipping %s items written before resuming.", str(count_items))
 
-        # Iterate over records and call REST API for additional metadata
+        # Iterate over records and call REST API for additional metadata. Inserts are
+        # committed in batches instead of once per item.
         with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-                for item in items:
+            with BatchWriter(db, batch_size=self.commit_batch_size,
+                             batch_interval=self.commit_interval) as writer:
+                for item in items[count_items:]:
                     count_items += 1
 
                     # Get item metadata
@@ -64,255 +220,27 @@ class ItemIndexer(Indexer):
                     # Create handle URL for item
                     item_url = self.base_url + item['handle']
 
-                    self.logger.debug(cursor.mogrify("INSERT INTO item_stats (collection_name, item_id, item_name, item_url) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING", (item_owning_collection_name, item_uuid, item_name, item_url)))
-                    cursor.execute("INSERT INTO item_stats (collection_name, item_id, item_name, item_url) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING", (item_owning_collection_name, item_uuid, item_name, item_url))
-                    db.commit()
-
-        for time_period in self.time_periods:
-            self.logger.info("Indexing Solr views for time period: %s ", time_period)
-            self.index_item_views(time_period=time_period)
-
-            self.logger.info("Indexing Solr downloads for time period: %s ", time_period)
-            self.index_item_downloads(time_period=time_period)
-
-    def index_item_views(self, time_period='all'):
-        """Index the item views"""
-
-        # Create base Solr url
-        solr_url = self.solr_server + "/statistics/select"
-
-        # Get Solr shards
-        shards = self.solr.get_statistics_shards()
-
-        # Solr params
-        solr_query_params = {
-            "q": f"type:2 AND id:/.{{36}}/",
-            "fq": "-isBot:true AND statistics_type:view",
-            "fl": "id",
-            "facet": "true",
-            "facet.field": "id",
-            "facet.mincount": 1,
-            "facet.limit": 1,
-            "facet.offset": 0,
-            "stats": "true",
-            "stats.field": "id",
-            "stats.calcdistinct": "true",
-            "shards": shards,
-            "rows": 0,
-            "wt": "json",
-        }
+                    writer.execute("INSERT INTO item_stats (collection_name, item_id, item_name, item_url) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING", (item_owning_collection_name, item_uuid, item_name, item_url))
 
-        # Get date range for Solr query if time period is specified
-        date_range = []
-        date_range = self.get_date_range(time_period)
-        if len(date_range) == 2:
-            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
-            if date_range[0] is not None and date_range[1] is not None:
-                date_start = date_range[0]
-                date_end = date_range[1]
-                solr_query_params['q'] = (solr_query_params['q'] + " AND " +
-                                          f"time:[{date_start} TO {date_end}]")
-        else:
-            self.logger.error("Error creating date range.")
-
-        # Make call to Solr for total views statistics
-        response = self.solr.call(url=solr_url, params=solr_query_params)
-        self.logger.info("Solr total item views query: %s", response.url)
-
-        try:
-            # get total number of distinct facets (countDistinct)
-            results_total_num_facets = response.json()["stats"]["stats_fields"]["id"][
-                "countDistinct"
-            ]
-        except TypeError:
-            self.logger.info("No item views to index.")
-            return
+                    # Map the item to its owning collection for SQL rollups
+                    if self.sql_rollups and item_owning_collection is not None:
+                        writer.execute("INSERT INTO item_collection_map (item_id, collection_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (item_uuid, item_owning_collection['uuid']))
 
-        # divide results into "pages" and round up to next integer
-        results_per_page = 100
-        results_num_pages = math.ceil(results_total_num_facets / results_per_page)
-        results_current_page = 0
+                    # Record the number of items written along with their inserts
+                    if count_items % self.items_per_checkpoint == 0:
+                        self.save_checkpoint(writer=writer, phase=self.items_phase,
+                                             facet_offset=count_items)
 
-        with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-
-                while results_current_page <= results_num_pages:
-                    print(
-                        f"Indexing item views (page {results_current_page + 1} " +
-                        f"of {results_num_pages + 1})"
-                    )
-
-                    # Solr params for current page
-                    solr_query_params = {
-                        "q": f"type:2 AND id:/.{{36}}/",
-                        "fq": "-isBot:true AND statistics_type:view",
-                        "fl": "id",
-                        "facet": "true",
-                        "facet.field": "id",
-                        "facet.mincount": 1,
-                        "facet.limit": results_per_page,
-                        "facet.offset": results_current_page * results_per_page,
-                        "shards": shards,
-                        "rows": 0,
-                        "wt": "json",
-                        "json.nl": "map",
-                    }
-
-                    if len(date_range) == 2:
-                        self.logger.info("Searching date range: %s - %s",
-                                         date_range[0], date_range[1])
-                        if date_range[0] is not None and date_range[1] is not None:
-                            date_start = date_range[0]
-                            date_end = date_range[1]
-                            solr_query_params['q'] = (solr_query_params['q'] + " AND " +
-                                                      f"time:[{date_start} TO {date_end}]")
-
-                    response = self.solr.call(url=solr_url, params=solr_query_params)
-                    self.logger.info("Solr item views query: %s", response.url)
-
-                    # Solr returns facets as a dict of dicts (see json.nl parameter)
-                    views = response.json()["facet_counts"]["facet_fields"]
-                    # Iterate over the facetField dict and get the UUIDs and views
-                    for item_uuid, item_views in views["id"].items():
-                        if len(item_uuid) == 36:
-                            if time_period == 'month':
-                                self.logger.debug(cursor.mogrify("UPDATE item_stats SET views_last_month = %s WHERE item_id = %s", (item_views, item_uuid)))
-                                cursor.execute("UPDATE item_stats SET views_last_month = %s WHERE item_id = %s", (item_views, item_uuid))
-                            elif time_period == 'year':
-                                self.logger.debug(cursor.mogrify("UPDATE item_stats SET views_academic_year = %s WHERE item_id = %s", (item_views, item_uuid)))
-                                cursor.execute("UPDATE item_stats SET views_academic_year = %s WHERE item_id = %s", (item_views, item_uuid))
-                            else:
-                                self.logger.debug(cursor.mogrify("UPDATE item_stats SET views_total = %s WHERE item_id = %s", (item_views, item_uuid)))
-                                cursor.execute("UPDATE item_stats SET views_total = %s WHERE item_id = %s", (item_views, item_uuid))
-                        else:
-                            self.logger.warning("Item ID value is not a UUID: %s",
-                                                item_uuid)
-
-                    # Commit changes to database
-                    db.commit()
-
-                    if self.delay:
-                        sleep(self.delay)
-
-                    results_current_page += 1
-
-    def index_item_downloads(self, time_period='all'):
-        """Index the item downloads"""
-
-        # Create base Solr url
-        solr_url = self.solr_server + "/statistics/select"
-
-        # Get Solr shards
-        shards = self.solr.get_statistics_shards()
-
-        # Solr params
-        solr_query_params = {
-            "q": f"type:0 AND owningItem:/.{{36}}/",
-            "fq": "-isBot:true AND statistics_type:view AND bundleName:ORIGINAL",
-            "fl": "owningItem",
-            "facet": "true",
-            "facet.field": "owningItem",
-            "facet.mincount": 1,
-            "facet.limit": 1,
-            "facet.offset": 0,
-            "stats": "true",
-            "stats.field": "owningItem",
-            "stats.calcdistinct": "true",
-            "shards": shards,
-            "rows": 0,
-            "wt": "json",
-        }
+                # Record the finished phase with the last batch of writes
+                if total_items > 0:
+                    self.save_checkpoint(writer=writer, phase=self.items_phase, completed=True)
 
-        # Get date range for Solr query if time period is specified
-        date_range = []
-        date_range = self.get_date_range(time_period)
-        if len(date_range) == 2:
-            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
-            if date_range[0] is not None and date_range[1] is not None:
-                date_start = date_range[0]
-                date_end = date_range[1]
-                solr_query_params['q'] = (solr_query_params['q'] + " AND " +
-                                          f"time:[{date_start} TO {date_end}]")
-        else:
-            self.logger.error("Error creating date range.")
-
-        # Make call to Solr for download statistics
-        response = self.solr.call(url=solr_url, params=solr_query_params)
-        self.logger.info("Solr total item downloads query: %s", response.url)
-
-        try:
-            # get total number of distinct facets (countDistinct)
-            results_total_num_facets = response.json()["stats"]["stats_fields"]["owningItem"][
-                "countDistinct"
-            ]
-        except TypeError:
-            self.logger.info("No item downloads to index.")
-            return
+            # The last batch was committed when the writer closed
+            self.commit_checkpoints(connection=db)
 
-        results_per_page = 100
-        results_num_pages = math.ceil(results_total_num_facets / results_per_page)
-        results_current_page = 0
+        # Views and downloads are indexed separately, e.g. by the tasks of a task queue
+        if not with_facets:
+            return
 
-        with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-
-                while results_current_page <= results_num_pages:
-                    # "pages" are zero based, but one based is more human readable
-                    print(
-                        f"Indexing item downloads (page {results_current_page + 1} " +
-                        f"of {results_num_pages + 1})"
-                    )
-
-                    # Solr params for current page
-                    solr_query_params = {
-                        "q": f"type:0 AND owningItem:/.{{36}}/",
-                        "fq": "-isBot:true AND statistics_type:view AND bundleName:ORIGINAL",
-                        "fl": "owningItem",
-                        "facet": "true",
-                        "facet.field": "owningItem",
-                        "facet.mincount": 1,
-                        "facet.limit": results_per_page,
-                        "facet.offset": results_current_page * results_per_page,
-                        "shards": shards,
-                        "rows": 0,
-                        "wt": "json",
-                        "json.nl": "map",
-                    }
-
-                    if len(date_range) == 2:
-                        self.logger.info("Searching date range: %s - %s",
-                                         date_range[0], date_range[1])
-                        if date_range[0] is not None and date_range[1] is not None:
-                            date_start = date_range[0]
-                            date_end = date_range[1]
-                            solr_query_params['q'] = (solr_query_params['q'] + " AND " +
-                                                      f"time:[{date_start} TO {date_end}]")
-
-                    response = self.solr.call(url=solr_url, params=solr_query_params)
-                    self.logger.info("Solr item downloads query: %s", response.url)
-
-                    # Solr returns facets as a dict of dicts (see json.nl parameter)
-                    downloads = response.json()["facet_counts"]["facet_fields"]
-                    # Iterate over the facetField dict and get the UUIDs and downloads
-                    for item_uuid, item_downloads in downloads["owningItem"].items():
-                        if len(item_uuid) == 36:
-                            if time_period == 'month':
-                                self.logger.debug(cursor.mogrify("UPDATE item_stats SET downloads_last_month = %s WHERE item_id = %s", (item_downloads, item_uuid)))
-                                cursor.execute("UPDATE item_stats SET downloads_last_month = %s WHERE item_id = %s", (item_downloads, item_uuid))
-                            elif time_period == 'year':
-                                self.logger.debug(cursor.mogrify("UPDATE item_stats SET downloads_academic_year = %s WHERE item_id = %s", (item_downloads, item_uuid)))
-                                cursor.execute("UPDATE item_stats SET downloads_academic_year = %s WHERE item_id = %s", (item_downloads, item_uuid))
-                            else:
-                                self.logger.debug(cursor.mogrify("UPDATE item_stats SET downloads_total = %s WHERE item_id = %s", (item_downloads, item_uuid)))
-                                cursor.execute("UPDATE item_stats SET downloads_total = %s WHERE item_id = %s", (item_downloads, item_uuid))
-                        else:
-                            self.logger.warning("Item ID value is not a UUID: %s",
-                                                item_uuid)
-
-                    # Commit changes to database
-                    db.commit()
-
-                    if self.delay:
-                        sleep(self.delay)
-
-                    results_current_page += 1
+        # Index all views and downloads of items
+        self.index_facets(facet_specs=self.facet_specs)
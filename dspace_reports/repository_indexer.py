@@ -1,5 +1,9 @@
 """Class for indexing a repository"""
 
+import json
+
+from psycopg import sql
+
 from lib.database import Database
 from dspace_reports.indexer import Indexer
 
@@ -16,6 +20,11 @@ class RepositoryIndexer(Indexer):
     def index_repository(self):
         """Index the entire repository"""
 
+        # A resumed run may already have the repository statistics
+        if all(self.is_phase_completed(phase='repository', time_period=time_period)
+               for time_period in self.time_periods):
+            return
+
         # Get repository information
         repository_uuid = 0
         repository_name = "Unknown"
@@ -29,210 +38,160 @@ class RepositoryIndexer(Indexer):
 
         self.logger.info("Indexing Repository: %s (UUID: %s)", repository_name, repository_uuid)
 
-        with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-                self.logger.debug(cursor.mogrify("INSERT INTO repository_stats (repository_id, repository_name) VALUES (%s, %s)", (repository_uuid, repository_name)))
-                cursor.execute("INSERT INTO repository_stats (repository_id, repository_name) VALUES (%s, %s)", (repository_uuid, repository_name))
-
-                db.commit()
-
-        # Index views and downloads for the current community
+        # Get date ranges of all time periods
+        date_ranges = {}
         for time_period in self.time_periods:
-            self.logger.info("Indexing repository items.")
-            self.index_repository_items(repository_uuid=repository_uuid, time_period=time_period)
+            date_range = self.get_date_range(time_period)
+            if len(date_range) != 2 or None in date_range:
+                self.logger.error("Error creating date range.")
+                continue
 
-            self.logger.info("Indexing repository views.")
-            self.index_repository_views(repository_uuid=repository_uuid, time_period=time_period)
+            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
+            date_ranges[time_period] = date_range
 
-            self.logger.info("Indexing repository downloads.")
-            self.index_repository_downloads(repository_uuid=repository_uuid,
-                                            time_period=time_period)
+        # Get items, views and downloads of every time period with one request to each core
+        self.logger.info("Indexing repository items.")
+        items = self.get_repository_items(date_ranges=date_ranges)
 
-    def index_repository_items(self, repository_uuid=None, time_period=None):
-        """Index repository items"""
+        self.logger.info("Indexing repository views and downloads.")
+        views_downloads = self.get_repository_views_downloads(date_ranges=date_ranges)
 
-        if repository_uuid is None or time_period is None:
+        if items is None or views_downloads is None:
+            self.logger.error("Unable to index repository statistics.")
             return
 
-        # Create base Solr URL
-        solr_url = self.solr_server + "/search/select"
-        self.logger.debug("Solr_URL: %s", solr_url)
-
-        # Default Solr params
-        solr_query_params = {
-            "q": "search.resourcetype:Item",
-            "start": "0",
-            "rows": "0",
-            "wt": "json"
-        }
-
-        # Get date range for Solr query if time period is specified
-        date_range = []
-        date_range = self.get_date_range(time_period)
-        if len(date_range) == 2:
-            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
-            if date_range[0] is not None and date_range[1] is not None:
-                date_start = date_range[0]
-                date_end = date_range[1]
-                solr_query_params["fq"] = f"dc.date.accessioned_dt:[{date_start} TO {date_end}]"
-        else:
-            self.logger.error("Error creating date range.")
-
-        # Make call to Solr for items statistics
-        response = self.solr.call(url=solr_url, params=solr_query_params)
-        self.logger.info("Calling Solr total items in repository: %s", response.url)
-
-        results_total_items = 0
-        try:
-            # Get total number of items
-            results_total_items = response.json()["response"]["numFound"]
-            self.logger.info("Solr - total items: %s", str(results_total_items))
-        except TypeError:
-            self.logger.info("No items to index, returning.")
-            return
+        # Metric, time period and value of every statistic of the repository
+        statistics = []
+        for time_period in date_ranges:
+            statistics.append(('items', time_period, items[time_period]))
+            statistics.append(('views', time_period, views_downloads['views'][time_period]))
+            statistics.append(('downloads', time_period,
+                               views_downloads['downloads'][time_period]))
 
+        # Store the repository row from the same snapshot in one transaction
         with Database(self.config['statistics_db']) as db:
             with db.cursor() as cursor:
-                if time_period == 'month':
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET items_last_month = %s WHERE repository_id = %s", (results_total_items, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET items_last_month = %s WHERE repository_id = %s", (results_total_items, repository_uuid))
-                elif time_period == 'year':
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET items_academic_year = %s WHERE repository_id = %s", (results_total_items, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET items_academic_year = %s WHERE repository_id = %s", (results_total_items, repository_uuid))
-                else:
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET items_total = %s WHERE repository_id = %s", (results_total_items, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET items_total = %s WHERE repository_id = %s", (results_total_items, repository_uuid))
+                self.logger.debug(cursor.mogrify("INSERT INTO repository_stats (repository_id, repository_name) VALUES (%s, %s) ON CONFLICT (repository_id) DO UPDATE SET repository_name = EXCLUDED.repository_name", (repository_uuid, repository_name)))
+                cursor.execute("INSERT INTO repository_stats (repository_id, repository_name) VALUES (%s, %s) ON CONFLICT (repository_id) DO UPDATE SET repository_name = EXCLUDED.repository_name", (repository_uuid, repository_name))
+
+                if len(statistics) > 0:
+                    columns = sql.SQL(', ').join(
+                        sql.SQL("{} = %s").format(
+                            sql.Identifier(self.get_period_column(metric, time_period)))
+                        for metric, time_period, _ in statistics)
+                    query = sql.SQL("UPDATE repository_stats SET {} WHERE repository_id = %s"
+                                    ).format(columns)
+                    params = [value for _, _, value in statistics] + [repository_uuid]
+                    self.logger.debug(cursor.mogrify(query, params))
+                    cursor.execute(query, params)
+
+                for metric, time_period, value in statistics:
+                    self.save_history(writer=cursor, entity_type='repository', metric=metric,
+                                      date_range=date_ranges[time_period],
+                                      rows=[(repository_uuid, value)])
+
+                # Record the finished phase with its results
+                for time_period, date_range in date_ranges.items():
+                    self.save_checkpoint(writer=cursor, phase='repository',
+                                         time_period=time_period, date_range=date_range,
+                                         completed=True)
 
                 # Commit changes
-                db.commit()
+                self.commit_checkpoints(connection=db)
 
-    def index_repository_views(self, repository_uuid=None, time_period=None):
-        """Index repository views"""
+    def get_repository_items(self, date_ranges=None):
+        """Get the number of repository items of each time period"""
 
-        if repository_uuid is None or time_period is None:
-            return
+        if date_ranges is None:
+            date_ranges = {}
 
-        # Create base Solr url
-        solr_url = self.solr_server + "/statistics/select"
+        # Create base Solr URL
+        solr_url = self.solr_server + "/search/select"
+        self.logger.debug("Solr_URL: %s", solr_url)
 
-        # Get Solr shards
-        shards = self.solr.get_statistics_shards()
+        # One query facet per time period
+        json_facet = {}
+        for time_period, date_range in date_ranges.items():
+            json_facet[time_period] = {
+                "type": "query",
+                "q": f"dc.date.accessioned_dt:[{date_range[0]} TO {date_range[1]}]"
+            }
 
-        # Default Solr params
         solr_query_params = {
-            "q": "type:2",
-            "fq": "-isBot:true AND statistics_type:view",
-            "shards": shards,
+            "q": "search.resourcetype:Item",
             "rows": 0,
-            "wt": "json"
+            "wt": "json",
+            "json.facet": json.dumps(json_facet)
         }
 
-        # Get date range for Solr query if time period is specified
-        date_range = []
-        date_range = self.get_date_range(time_period)
-        if len(date_range) == 2:
-            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
-            if date_range[0] is not None and date_range[1] is not None:
-                date_start = date_range[0]
-                date_end = date_range[1]
-                solr_query_params['q'] = (solr_query_params['q'] + " AND " +
-                                          f"time:[{date_start} TO {date_end}]")
-        else:
-            self.logger.error("Error creating date range.")
-
-        # Make call to Solr for views statistics
+        # Make call to Solr for items statistics
         response = self.solr.call(url=solr_url, params=solr_query_params)
-        self.logger.info("Calling Solr total item views in repository: %s", response.url)
+        self.logger.info("Calling Solr total items in repository: %s", response.url)
 
-        results_num_found = 0
         try:
-            # Get total number of items
-            results_num_found = response.json()["response"]["numFound"]
-            self.logger.info("Solr repository - total item views: %s", str(results_num_found))
-        except TypeError:
-            self.logger.info("No item views to index.")
-            return
+            facets = response.json()["facets"]
+        except (TypeError, KeyError):
+            self.logger.info("No items to index.")
+            return None
 
-        self.logger.info("Total repository item views: %s", str(results_num_found))
+        items = {}
+        for time_period in date_ranges:
+            items[time_period] = facets.get(time_period, {}).get("count", 0)
+            self.logger.info("Solr - total items for time period %s: %s", time_period,
+                             str(items[time_period]))
 
-        with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-                self.logger.info("Setting repository views stats with %s views for time period: %s",
-                                 str(results_num_found), time_period)
-                if time_period == 'month':
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET views_last_month = %s WHERE repository_id = %s", (results_num_found, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET views_last_month = %s WHERE repository_id = %s", (results_num_found, repository_uuid))
-                elif time_period == 'year':
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET views_academic_year = %s WHERE repository_id = %s", (results_num_found, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET views_academic_year = %s WHERE repository_id = %s", (results_num_found, repository_uuid))
-                else:
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET views_total = %s WHERE repository_id = %s", (results_num_found, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET views_total = %s WHERE repository_id = %s", (results_num_found, repository_uuid))
+        return items
 
-                # Commit changes
-                db.commit()
+    def get_repository_views_downloads(self, date_ranges=None):
+        """Get the number of repository item views and downloads of each time period"""
 
-    def index_repository_downloads(self, repository_uuid=None, time_period=None):
-        """Index repository downloads"""
+        if date_ranges is None:
+            date_ranges = {}
 
-        if repository_uuid is None or time_period is None:
-            return
+        # Create base Solr url
+        solr_url = self.solr_server + "/statistics/select"
 
         # Get Solr shards
         shards = self.solr.get_statistics_shards()
 
-        # Create base Solr url
-        solr_url = self.solr_server + "/statistics/select"
+        # One query facet per metric and time period
+        json_facet = {}
+        for time_period, date_range in date_ranges.items():
+            time_query = f"time:[{date_range[0]} TO {date_range[1]}]"
+            json_facet['views_' + time_period] = {
+                "type": "query",
+                "q": f"type:2 AND {time_query}"
+            }
+            json_facet['downloads_' + time_period] = {
+                "type": "query",
+                "q": f"type:0 AND bundleName:ORIGINAL AND {time_query}"
+            }
 
-        # Default Solr params
         solr_query_params = {
-            "q": "type:0",
-            "fq": "-isBot:true AND statistics_type:view AND bundleName:ORIGINAL",
+            "q": "*:*",
+            "fq": "-isBot:true AND statistics_type:view",
             "shards": shards,
             "rows": 0,
-            "wt": "json"
+            "wt": "json",
+            "json.facet": json.dumps(json_facet)
         }
 
-        # Get date range for Solr query if time period is specified
-        date_range = []
-        date_range = self.get_date_range(time_period)
-        if len(date_range) == 2:
-            self.logger.info("Searching date range: %s - %s", date_range[0], date_range[1])
-
-            if date_range[0] is not None and date_range[1] is not None:
-                date_start = date_range[0]
-                date_end = date_range[1]
-                solr_query_params['q'] = (solr_query_params['q'] + " AND " +
-                                          f"time:[{date_start} TO {date_end}]")
-        else:
-            self.logger.error("Error creating date range.")
-
-        # Make call to Solr for views statistics
+        # Make call to Solr for views and downloads statistics
         response = self.solr.call(url=solr_url, params=solr_query_params)
-        self.logger.info("Calling Solr total item downloads in repository: %s", response.url)
+        self.logger.info("Calling Solr total item views and downloads in repository: %s",
+                         response.url)
 
-        results_num_found = 0
         try:
-            # Get total number of items
-            results_num_found = response.json()["response"]["numFound"]
-            self.logger.info("Solr repository - total item downloads: %s", str(results_num_found))
-        except TypeError:
-            self.logger.info("No item downloads to index.")
-            return
-
-        self.logger.info("Total repository item downloads: %s", str(results_num_found))
-
-        with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-                if time_period == 'month':
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET downloads_last_month = downloads_last_month + %s WHERE repository_id = %s", (results_num_found, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET downloads_last_month = downloads_last_month + %s WHERE repository_id = %s", (results_num_found, repository_uuid))
-                elif time_period == 'year':
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET downloads_academic_year = downloads_academic_year + %s WHERE repository_id = %s", (results_num_found, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET downloads_academic_year = downloads_academic_year + %s WHERE repository_id = %s", (results_num_found, repository_uuid))
-                else:
-                    self.logger.debug(cursor.mogrify("UPDATE repository_stats SET downloads_total = downloads_total + %s WHERE repository_id = %s'", (results_num_found, repository_uuid)))
-                    cursor.execute("UPDATE repository_stats SET downloads_total = downloads_total + %s WHERE repository_id = %s", (results_num_found, repository_uuid))
-
-                # Commit changes
-                db.commit()
+            facets = response.json()["facets"]
+        except (TypeError, KeyError):
+            self.logger.info("No item views or downloads to index.")
+            return None
+
+        views_downloads = {'views': {}, 'downloads': {}}
+        for metric, counts in views_downloads.items():
+            for time_period in date_ranges:
+                counts[time_period] = facets.get(metric + '_' + time_period, {}).get("count", 0)
+                self.logger.info("Total repository item %s for time period %s: %s", metric,
+                                 time_period, str(counts[time_period]))
+
+        return views_downloads
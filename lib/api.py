@@ -1,6 +1,7 @@
 """Class for interacting with a DSpace 7+ REST API"""
 
 import logging
+import threading
 import requests
 
 
@@ -30,6 +31,10 @@ class DSpaceRestApi():
         # Create session
         self.session = requests.Session()
 
+        # Threads sharing the session log in again one at a time, see reauthenticate()
+        self.login_lock = threading.Lock()
+        self.login_count = 0
+
         # Get CSRF token
         self.token = None
         self.get_token()
@@ -121,7 +126,8 @@ class DSpaceRestApi():
         final_url = self.api_url + command + parameters
         return final_url
 
-    def rest_call(self, call_type='GET', url='', params=None, data=None, headers=None):
+    def rest_call(self, call_type='GET', url='', params=None, data=None, headers=None,
+                  retry=True):
         """Make call to REST API"""
 
         if params is None:
@@ -135,6 +141,9 @@ class DSpaceRestApi():
 
         self.logger.debug("Calling REST API with URL: %s", url)
 
+        # Logins before this call, to tell if another thread logs in again meanwhile
+        login_count = self.login_count
+
         if call_type == 'GET':
             response = self.session.get(url, params=params, headers=headers, cookies=self.cookies)
         else:
@@ -144,6 +153,13 @@ class DSpaceRestApi():
         if response.status_code == 200:
             return response.json()
 
+        # A session shared by a long indexing run can outlive its login, so log in again
+        # and retry once
+        if response.status_code == 401 and retry and self.authenticated:
+            if self.reauthenticate(login_count=login_count):
+                return self.rest_call(call_type=call_type, url=url, params=params, data=data,
+                                      headers=headers, retry=False)
+
         # Log errors
         if response.status_code >= 400 and response.status_code < 600:
             self.logger.error("Error while making rest call, (HTTP code: %s) %s",
@@ -151,6 +167,20 @@ class DSpaceRestApi():
 
         return None
 
+    def reauthenticate(self, login_count=None):
+        """Log in again after a call was rejected, unless another thread did since the call"""
+
+        # Only the first thread with an expired session logs in, the others wait for it
+        # and retry with the new token
+        with self.login_lock:
+            if self.login_count == login_count:
+                self.logger.info("REST API session expired, authenticating again.")
+                self.get_token()
+                self.authenticated = self.authenticate()
+                self.login_count += 1
+
+            return self.authenticated
+
     def get_site(self):
         """Get site information"""
 
@@ -0,0 +1,157 @@
+"""Class for recording the progress of an indexing run"""
+
+import logging
+import threading
+
+from lib.database import Database
+
+
+class Checkpoints():
+    """Class for recording the progress of an indexing run"""
+
+    def __init__(self, config=None):
+        self.config = config
+        self.run_id = None
+        self.logger = logging.getLogger('dspace-reports')
+
+        # Committed checkpoints of the current run, keyed by (phase, time_period), and
+        # the checkpoints saved in open transactions, keyed by connection. Indexers of
+        # several threads share them.
+        self.checkpoints = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def start_run(self, resume=False):
+        """Start a new indexing run or resume the last unfinished one"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                if resume:
+                    cursor.execute("SELECT run_id FROM indexing_runs WHERE finished_at IS NULL ORDER BY run_id DESC LIMIT 1")
+                    row = cursor.fetchone()
+                    if row is not None:
+                        self.run_id = row[0]
+                        self.logger.info("Resuming indexing run: %s", str(self.run_id))
+                        self.load_checkpoints(cursor=cursor)
+                        return True
+
+                    self.logger.info("No unfinished indexing run to resume.")
+
+                cursor.execute("INSERT INTO indexing_runs (started_at) VALUES (now()) RETURNING run_id")
+                self.run_id = cursor.fetchone()[0]
+                db.commit()
+
+        self.logger.info("Starting indexing run: %s", str(self.run_id))
+        return False
+
+    def join_run(self, run_id=None):
+        """Work on an unfinished indexing run, by default the last one, from another process"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                if run_id is None:
+                    cursor.execute("SELECT run_id FROM indexing_runs WHERE finished_at IS NULL ORDER BY run_id DESC LIMIT 1")
+                else:
+                    cursor.execute("SELECT run_id FROM indexing_runs WHERE finished_at IS NULL AND run_id = %s", (run_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    self.logger.info("No unfinished indexing run to join.")
+                    return False
+
+                self.run_id = row[0]
+                self.logger.info("Joining indexing run: %s", str(self.run_id))
+                self.load_checkpoints(cursor=cursor)
+
+        return True
+
+    def load_checkpoints(self, cursor=None):
+        """Load the checkpoints of the current run"""
+
+        checkpoints = {}
+        cursor.execute("SELECT phase, time_period, date_start, date_end, facet_offset, completed FROM indexing_checkpoints WHERE run_id = %s", (self.run_id,))
+        for phase, time_period, date_start, date_end, facet_offset, completed \
+                in cursor.fetchall():
+            checkpoints[(phase, time_period)] = {
+                'date_range': [date_start, date_end],
+                'facet_offset': facet_offset,
+                'completed': completed
+            }
+
+        with self.lock:
+            self.checkpoints = checkpoints
+            self.pending = {}
+
+    def finish_run(self):
+        """Mark the current indexing run as finished"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("UPDATE indexing_runs SET finished_at = now() WHERE run_id = %s", (self.run_id,))
+                db.commit()
+
+        self.logger.info("Finished indexing run: %s", str(self.run_id))
+
+    def get_date_range(self, time_period=None):
+        """Get the date range already used for a time period in this run"""
+
+        with self.lock:
+            checkpoints = list(self.checkpoints.items())
+
+        for (_, checkpoint_time_period), checkpoint in checkpoints:
+            if checkpoint_time_period == time_period and None not in checkpoint['date_range']:
+                return list(checkpoint['date_range'])
+
+        return None
+
+    def is_completed(self, phase=None, time_period=''):
+        """Check if a phase finished in this run"""
+
+        with self.lock:
+            checkpoint = self.checkpoints.get((phase, time_period))
+        return checkpoint is not None and checkpoint['completed']
+
+    def get_facet_offset(self, phase=None, time_period=''):
+        """Get the facet offset to continue a phase from"""
+
+        with self.lock:
+            checkpoint = self.checkpoints.get((phase, time_period))
+        if checkpoint is None or checkpoint['completed']:
+            return 0
+
+        return checkpoint['facet_offset']
+
+    def save(self, writer=None, phase=None, time_period='', date_range=None, facet_offset=0,
+             completed=False):
+        """Save a checkpoint with the writer (cursor or BatchWriter) of the phase's writes
+
+        The checkpoint is used by this run after the writer's connection is committed
+        with commit().
+        """
+
+        if date_range is None or len(date_range) != 2:
+            date_range = [None, None]
+
+        # Saved in the same transaction as the statistics so both are committed together
+        writer.execute("INSERT INTO indexing_checkpoints (run_id, phase, time_period, date_start, date_end, facet_offset, completed, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s, now()) ON CONFLICT (run_id, phase, time_period) DO UPDATE SET date_start = EXCLUDED.date_start, date_end = EXCLUDED.date_end, facet_offset = EXCLUDED.facet_offset, completed = EXCLUDED.completed, updated_at = EXCLUDED.updated_at", (self.run_id, phase, time_period, date_range[0], date_range[1], facet_offset, completed))
+
+        # Only known to this run once the transaction is committed, see commit()
+        with self.lock:
+            self.pending.setdefault(writer.connection, {})[(phase, time_period)] = {
+                'date_range': list(date_range),
+                'facet_offset': facet_offset,
+                'completed': completed
+            }
+
+    def commit(self, connection=None):
+        """Commit a connection and keep the checkpoints saved in its transaction"""
+
+        connection.commit()
+        with self.lock:
+            self.checkpoints.update(self.pending.pop(connection, {}))
+
+    def rollback(self, connection=None):
+        """Roll back a connection and forget the checkpoints saved in its transaction"""
+
+        connection.rollback()
+        with self.lock:
+            self.pending.pop(connection, None)
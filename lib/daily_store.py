@@ -0,0 +1,202 @@
+"""Class for keeping daily statistics counts in memory-mapped arrays"""
+
+import json
+import logging
+import os
+
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class DailyStore():
+    """Class for keeping daily counts of one metric per entity in a memory-mapped matrix
+
+    The counts are stored in <name>.npy as an (entity × day) matrix and the counts before
+    the first day in <name>.base.npy. <name>.json holds the first day of the matrix, the
+    UUID of every row and the day the counts are filled until.
+    """
+
+    # Rows and days are added in chunks so the matrix is not copied for every new entity
+    row_chunk = 1024
+    day_chunk = 366
+
+    def __init__(self, directory=None, name=None, first_day=None):
+        self.logger = logging.getLogger('dspace-reports')
+
+        if np is None:
+            raise ImportError("The numpy package is required for the daily statistics store.")
+
+        self.directory = directory
+        self.name = name
+        self.matrix_path = os.path.join(directory, name + '.npy')
+        self.base_path = os.path.join(directory, name + '.base.npy')
+        self.metadata_path = os.path.join(directory, name + '.json')
+
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(self.metadata_path) and os.path.exists(self.matrix_path):
+            with open(self.metadata_path, 'r', encoding='utf-8') as metadata_file:
+                metadata = json.load(metadata_file)
+
+            self.first_day = date.fromisoformat(metadata['first_day'])
+            self.filled_until = None
+            if metadata.get('filled_until'):
+                self.filled_until = date.fromisoformat(metadata['filled_until'])
+            self.uuids = metadata['uuids']
+            self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+            if os.path.exists(self.base_path):
+                self.base = np.lib.format.open_memmap(self.base_path, mode='r+')
+            else:
+                self.base = np.lib.format.open_memmap(self.base_path, mode='w+',
+                                                      dtype=np.int64,
+                                                      shape=(self.matrix.shape[0],))
+        else:
+            if first_day is None:
+                first_day = date.today()
+
+            self.first_day = first_day
+            self.filled_until = None
+            self.uuids = []
+            self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='w+',
+                                                    dtype=np.int32,
+                                                    shape=(self.row_chunk, self.day_chunk))
+            self.base = np.lib.format.open_memmap(self.base_path, mode='w+', dtype=np.int64,
+                                                  shape=(self.row_chunk,))
+
+        self.rows = {uuid: row for row, uuid in enumerate(self.uuids)}
+
+    def day_index(self, day=None):
+        """Get the column of a day"""
+
+        return (day - self.first_day).days
+
+    def row_index(self, uuid=None):
+        """Get the row of an entity, adding a row for a new entity"""
+
+        row = self.rows.get(uuid)
+        if row is None:
+            row = len(self.uuids)
+            self.uuids.append(uuid)
+            self.rows[uuid] = row
+
+        return row
+
+    def ensure_shape(self, rows=0, days=0):
+        """Grow the matrix to hold at least the given number of rows and days"""
+
+        num_rows, num_days = self.matrix.shape
+        if rows <= num_rows and days <= num_days:
+            return
+
+        new_rows = max(num_rows, -(-rows // self.row_chunk) * self.row_chunk)
+        new_days = max(num_days, -(-days // self.day_chunk) * self.day_chunk)
+        self.logger.debug("Growing daily store %s to %s rows and %s days.", self.name,
+                          str(new_rows), str(new_days))
+
+        # Copy into a new file and move it over the old one
+        new_matrix_path = self.matrix_path + '.new'
+        new_matrix = np.lib.format.open_memmap(new_matrix_path, mode='w+', dtype=np.int32,
+                                               shape=(new_rows, new_days))
+        new_matrix[:num_rows, :num_days] = self.matrix
+        new_matrix.flush()
+        del new_matrix
+        del self.matrix
+
+        os.replace(new_matrix_path, self.matrix_path)
+        self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+
+        if new_rows > self.base.shape[0]:
+            new_base_path = self.base_path + '.new'
+            new_base = np.lib.format.open_memmap(new_base_path, mode='w+', dtype=np.int64,
+                                                 shape=(new_rows,))
+            new_base[:self.base.shape[0]] = self.base
+            new_base.flush()
+            del new_base
+            del self.base
+
+            os.replace(new_base_path, self.base_path)
+            self.base = np.lib.format.open_memmap(self.base_path, mode='r+')
+
+    def clear_days(self, start_day=None, end_day=None):
+        """Set the counts of all entities to 0 from start_day up to, not including, end_day"""
+
+        start = max(self.day_index(start_day), 0)
+        end = min(self.day_index(end_day), self.matrix.shape[1])
+        if start < end:
+            self.matrix[:, start:end] = 0
+
+    def set_counts(self, uuids=None, start_day=None, counts=None):
+        """Set the daily counts (one list per UUID) of consecutive days from start_day"""
+
+        if not uuids:
+            return
+
+        counts = np.asarray(counts, dtype=np.int32)
+        start = self.day_index(start_day)
+        if start < 0:
+            # Only the days from the first day on are stored
+            self.logger.debug("Ignoring daily counts before %s.", self.first_day.isoformat())
+            counts = counts[:, -start:]
+            start = 0
+
+        end = start + counts.shape[1]
+        if end <= start:
+            return
+
+        rows = np.fromiter((self.row_index(uuid) for uuid in uuids), dtype=np.int64,
+                           count=len(uuids))
+        self.ensure_shape(rows=len(self.uuids), days=end)
+        self.matrix[rows, start:end] = counts
+
+    def set_base(self, uuids=None, counts=None):
+        """Set the counts from before the first day"""
+
+        if not uuids:
+            return
+
+        rows = np.fromiter((self.row_index(uuid) for uuid in uuids), dtype=np.int64,
+                           count=len(uuids))
+        self.ensure_shape(rows=len(self.uuids))
+        self.base[rows] = np.asarray(counts, dtype=np.int64)
+
+    def window_sums(self, start_day=None, end_day=None, include_base=False):
+        """Get the UUIDs and their summed counts from start_day up to, not including, end_day
+
+        With include_base the counts from before the first day are added, which makes the
+        sums all-time totals when start_day is not after the first day.
+        """
+
+        start = max(self.day_index(start_day), 0)
+        end = min(self.day_index(end_day), self.matrix.shape[1])
+        num_rows = len(self.uuids)
+
+        sums = np.zeros(num_rows, dtype=np.int64)
+        if start < end:
+            sums = self.matrix[:num_rows, start:end].sum(axis=1, dtype=np.int64)
+        if include_base:
+            sums = sums + self.base[:num_rows]
+
+        return list(self.uuids), sums
+
+    def flush(self, filled_until=None):
+        """Write the matrix and metadata to disk"""
+
+        if filled_until is not None:
+            self.filled_until = filled_until
+
+        self.matrix.flush()
+        self.base.flush()
+
+        metadata = {
+            'first_day': self.first_day.isoformat(),
+            'filled_until': self.filled_until.isoformat() if self.filled_until else None,
+            'uuids': self.uuids
+        }
+        temp_metadata_path = self.metadata_path + '.new'
+        with open(temp_metadata_path, 'w', encoding='utf-8') as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(temp_metadata_path, self.metadata_path)
@@ -1,6 +1,10 @@
 """Class for interacting with a DSpace 7+ database"""
 
 import logging
+from contextlib import nullcontext
+from itertools import groupby
+from operator import itemgetter
+from time import monotonic
 import psycopg
 
 
@@ -12,10 +16,24 @@ class Database():
         self._connection_uri = f"dbname={config['name']} user={config['username']} password={config['password']} host={config['host']} port={config['port']}"
         self.logger = logging.getLogger('dspace-reports')
 
+        # Session settings sent to the server when connecting
+        session_settings = []
+        if config.get('schema'):
+            # Resolve unqualified table names in the given schema first, e.g. staging tables
+            session_settings.append(f"-c search_path={config['schema']},\"$user\",public")
+        if config.get('synchronous_commit'):
+            # 'off' lets commits return before the WAL is flushed to disk
+            session_settings.append(f"-c synchronous_commit={config['synchronous_commit']}")
+
+        self._connection_options = {}
+        if len(session_settings) > 0:
+            self._connection_options['options'] = ' '.join(session_settings)
+
     def __enter__(self):
         try:
             self._connection = psycopg.connect(
-                self._connection_uri, cursor_factory=psycopg.ClientCursor
+                self._connection_uri, cursor_factory=psycopg.ClientCursor,
+                **self._connection_options
             )
         except psycopg.OperationalError as err:
             self.logger.error("Cannot connect to database. Please check connection information.")
@@ -34,7 +52,8 @@ class Database():
         # Create connection to database
         try:
             self.connection = psycopg.connect(self._connection_uri,
-                                              cursor_factory=psycopg.ClientCursor)
+                                              cursor_factory=psycopg.ClientCursor,
+                                              **self._connection_options)
             return True
         except psycopg.OperationalError as err:
             self.logger.error("Cannot connect to database. Please check connection information.")
@@ -47,3 +66,69 @@ class Database():
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self._connection.close()
+
+
+class BatchWriter():
+    """Class for queueing database writes and sending them in batches"""
+
+    def __init__(self, connection, batch_size=1000, batch_interval=0):
+        self.connection = connection
+        self.batch_size = batch_size
+
+        # Maximum number of seconds statements wait in the queue, 0 to only use batch_size
+        self.batch_interval = batch_interval
+        self.last_flush = monotonic()
+
+        self.statements = []
+        self.logger = logging.getLogger('dspace-reports')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # Only write the remaining statements if the block finished without errors
+        if exc_type is None:
+            self.flush()
+
+    def execute(self, query, params):
+        """Queue a statement and flush the queue once it reaches the batch size or interval"""
+
+        self.statements.append((query, params))
+        if len(self.statements) >= self.batch_size:
+            self.flush()
+        elif self.batch_interval and monotonic() - self.last_flush >= self.batch_interval:
+            self.flush()
+
+    def executemany(self, query, params_seq):
+        """Queue a statement for each set of parameters"""
+
+        for params in params_seq:
+            self.execute(query, params)
+
+    def flush(self):
+        """Send all queued statements and commit them in a single transaction"""
+
+        if len(self.statements) == 0:
+            return
+
+        # Pipeline mode sends all statements without waiting for a round trip per statement.
+        # It needs libpq 14 or later, otherwise the statements are sent one by one.
+        if psycopg.Pipeline.is_supported():
+            pipeline = self.connection.pipeline()
+        else:
+            pipeline = nullcontext()
+
+        with pipeline, self.connection.cursor() as cursor:
+            # Consecutive statements with the same query are sent with executemany(). Only
+            # consecutive statements are grouped so the original order is kept.
+            for query, statements in groupby(self.statements, key=itemgetter(0)):
+                params_seq = [params for _, params in statements]
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    for params in params_seq:
+                        self.logger.debug(cursor.mogrify(query, params))
+                cursor.executemany(query, params_seq)
+
+        self.connection.commit()
+        self.logger.debug("Committed %s queued statements.", str(len(self.statements)))
+        self.statements = []
+        self.last_flush = monotonic()
@@ -3,7 +3,6 @@
 import csv
 import os
 import logging
-import shutil
 from zipfile import ZIP_DEFLATED, ZipFile
 import xlsxwriter
 from lib.util import Utilities
@@ -12,6 +11,9 @@ from lib.util import Utilities
 class Output():
     """Class for saving stats reports to CSV and Excel files"""
 
+    # Table columns left out of the reports
+    excluded_columns = ['repository_id']
+
     def __init__(self, config=None):
         self.config = config
         self.logger = logging.getLogger('dataverse-reports')
@@ -22,8 +24,12 @@ class Output():
         if self.work_dir[len(self.work_dir)-1] != '/':
             self.work_dir = self.work_dir + '/'
 
-    def save_report_csv_file(self, output_file_path=None, headers=None, data=None):
-        """Save stats report to CSV file"""
+    def save_report_csv_file(self, output_file_path=None, headers=None, data=None,
+                             column_map=None):
+        """Save stats report to CSV file, naming the columns after the column map"""
+
+        if column_map is None:
+            column_map = {}
 
         if headers is None:
             headers = []
@@ -43,52 +49,20 @@ class Output():
             return False
 
         # TODO: make this configurable
-        if "repository_id" in headers:
-            headers.remove("repository_id")
+        for column in self.excluded_columns:
+            if column in headers:
+                headers.remove(column)
 
         with open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=headers, extrasaction='ignore',
-                                    dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
-            writer.writeheader()
+                                    dialect='excel', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow({header: column_map.get(header, header) for header in headers})
             for result in data:
                 writer.writerow(result)
 
         self.logger.info("Saved report to CSV file %s.", output_file_path)
         return output_file_path
 
-    def update_header_report_csv_file(self, input_file_path=None, headers_old=None, 
-                                      headers_new=None):
-        """Update headers of CSV file"""
-
-        # Sanity checks
-        if input_file_path is None:
-            self.logger.error("Input file path is required.")
-            return False
-        if not headers_old:
-            self.logger.error("Old report headers are required.")
-            return False
-        if not headers_new:
-            self.logger.error("New report headers are required.")
-            return False
-        if not self.utilities.check_file_exists(input_file_path):
-            self.logger.error("Input file doesn't exist.")
-            return False
-
-        temp_csv_file_path = self.work_dir + 'temp.csv'
-
-        with open(input_file_path, 'r', encoding="utf-8") as fp:
-            reader = csv.DictReader(fp, fieldnames=headers_new)
-
-            with open(temp_csv_file_path, 'w', newline='', encoding="utf-8") as fh:
-                writer = csv.DictWriter(fh, fieldnames=reader.fieldnames)
-                writer.writeheader()
-                header_mapping = next(reader)
-                writer.writerows(reader)
-
-        # Copy tempfile to report csv file
-        destination_file_path = shutil.copyfile(temp_csv_file_path, input_file_path)
-        return destination_file_path
-
     def save_report_excel_file(self, output_file_path=None, worksheet_files=None):
         """"Save stats report to Excel file"""
 
@@ -134,6 +108,60 @@ class Output():
         self.logger.info("Saved report to Excel file %s.", output_file_path)
         return output_file_path
 
+    def save_report_excel_file_from_rows(self, output_file_path=None, worksheets=None):
+        """Save stats report to Excel file from (name, headers, rows, column map) worksheets
+
+        The workbook is written in constant memory mode, so each row goes to disk as soon as
+        it is written. Numbers, text and empty values are written with their own calls
+        instead of having xlsxwriter guess the type of every cell.
+        """
+
+        # Sanity checks
+        if output_file_path is None:
+            self.logger.error("Output file path is required.")
+            return False
+        if worksheets is None:
+            self.logger.error("Worksheets are required.")
+            return False
+        if not self.utilities.ensure_directory_exists(output_file_path):
+            self.logger.error("Output directory doesn't exist and can't be created.")
+            return False
+
+        # Create Excel workbook
+        self.logger.info("Creating Excel file: %s", output_file_path)
+        workbook = xlsxwriter.Workbook(output_file_path, {'constant_memory': True})
+
+        # Add worksheet(s)
+        for worksheet_name, headers, data, column_map in worksheets:
+            if column_map is None:
+                column_map = {}
+
+            headers = [header for header in headers if header not in self.excluded_columns]
+
+            worksheet = workbook.add_worksheet(worksheet_name)
+            worksheet.freeze_panes(1, 0)
+            for c, header in enumerate(headers):
+                worksheet.write_string(0, c, column_map.get(header, header))
+
+            # The call is chosen for every cell, as a column may hold NULLs or mixed types
+            r = 0
+            for r, result in enumerate(data, start=1):
+                for c, header in enumerate(headers):
+                    value = result.get(header)
+                    if value is None:
+                        worksheet.write_blank(r, c, None)
+                    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                        worksheet.write_number(r, c, value)
+                    else:
+                        worksheet.write_string(r, c, str(value))
+
+            self.logger.debug("Wrote %s rows to worksheet %s.", str(r), worksheet_name)
+
+        workbook.close()
+
+        self.logger.info("Saved report to Excel file %s.", output_file_path)
+        return output_file_path
+
     def save_report_zip_archive(self, output_file_path=None, excel_report_file=None):
         """"Save stats report to zip file"""
 
@@ -0,0 +1,264 @@
+"""Classes for reading stats reports from the statistics database or a local copy"""
+
+import logging
+import os
+import tempfile
+
+from psycopg import sql
+
+from lib.database import Database
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+class PostgresReportBackend():
+    """Class for reading stats reports directly from the statistics database"""
+
+    # CSV reports are only written with COPY if report_csv_copy is set
+    copy_csv = False
+
+    def __init__(self, config=None):
+        self.config = config
+        self.logger = logging.getLogger('dspace-reports')
+
+        # Number of rows fetched from the server-side cursor at a time
+        self.itersize = config.get('report_itersize', 2000)
+
+    def prepare(self):
+        """Nothing to prepare, reports are read from the live tables"""
+
+        return True
+
+    def export(self, **_kwargs):
+        """Nothing to export, reports are read from the live tables"""
+
+        return True
+
+    def fetch_report(self, table=None, order_by=None):
+        """Get column names and an iterator over the rows of a stats table"""
+
+        rows = self.stream_report(table=table, order_by=order_by)
+        column_names = next(rows)
+
+        return column_names, rows
+
+    def stream_report(self, table=None, order_by=None):
+        """Yield the column names, then the rows of a stats table from a server-side cursor"""
+
+        query = sql.SQL("SELECT * FROM {} ORDER BY {} ASC").format(sql.Identifier(table),
+                                                                   sql.Identifier(order_by))
+
+        with Database(self.config['statistics_db']) as db:
+            # Rows stay on the server until the CSV writer asks for them
+            with db.cursor(name='report_' + table) as cursor:
+                cursor.itersize = self.itersize
+                self.logger.debug(query.as_string(db))
+                cursor.execute(query)
+
+                column_names = [col[0] for col in cursor.description]
+                yield column_names
+
+                for row in cursor:
+                    yield dict(zip(column_names, row))
+
+    def copy_report_csv(self, table=None, order_by=None, output_file_path=None,
+                        column_map=None, excluded_columns=None):
+        """Save a stats table to a CSV file with COPY, renaming its columns in the query"""
+
+        if column_map is None:
+            column_map = {}
+        if excluded_columns is None:
+            excluded_columns = []
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute(sql.SQL("SELECT * FROM {} LIMIT 0").format(sql.Identifier(table)))
+                columns = sql.SQL(', ').join(
+                    sql.SQL("{} AS {}").format(sql.Identifier(col[0]),
+                                               sql.Identifier(column_map.get(col[0], col[0])))
+                    for col in cursor.description if col[0] not in excluded_columns)
+
+                query = sql.SQL("COPY (SELECT {} FROM {} ORDER BY {} ASC) TO STDOUT (FORMAT CSV, HEADER)").format(columns, sql.Identifier(table), sql.Identifier(order_by))
+                self.logger.debug(query.as_string(db))
+
+                # Postgres writes the CSV, the rows are only copied to the file
+                with open(output_file_path, 'wb') as csv_file:
+                    with cursor.copy(query) as copy:
+                        for data in copy:
+                            csv_file.write(data)
+
+        self.logger.info("Saved report to CSV file %s.", output_file_path)
+        return output_file_path
+
+    def close(self):
+        """Nothing to close, connections are opened per report"""
+
+
+class DuckDBReportBackend():
+    """Class for reading stats reports from a local DuckDB copy of the statistics tables
+
+    The copy is exported at the end of an indexing run and of every single indexer with
+    export().
+    """
+
+    # Stats tables of the reports
+    report_tables = ['repository_stats', 'community_stats', 'collection_stats', 'item_stats']
+
+    # CSV reports are always written by DuckDB instead of from the rows in Python
+    copy_csv = True
+
+    # DuckDB types of Postgres column types, other columns are case-insensitive text
+    column_types = {
+        'smallint': 'SMALLINT',
+        'integer': 'INTEGER',
+        'bigint': 'BIGINT',
+        'numeric': 'DOUBLE',
+        'double precision': 'DOUBLE',
+        'boolean': 'BOOLEAN',
+        'date': 'DATE',
+        'timestamp without time zone': 'TIMESTAMP'
+    }
+
+    def __init__(self, config=None):
+        self.config = config
+        self.logger = logging.getLogger('dspace-reports')
+
+        # Ensure work_dir has trailing slash
+        self.work_dir = config['work_dir']
+        if self.work_dir[len(self.work_dir)-1] != '/':
+            self.work_dir = self.work_dir + '/'
+
+        self.database_path = config.get('report_database') or (self.work_dir +
+                                                               'dspace-reports.duckdb')
+        self.connection = None
+
+        # Number of rows fetched from DuckDB at a time
+        self.itersize = config.get('report_itersize', 2000)
+
+    def prepare(self):
+        """Open the DuckDB copy of the stats tables, exporting them if there is none yet"""
+
+        if not os.path.exists(self.database_path):
+            self.logger.info("No report database at %s yet.", self.database_path)
+            self.export()
+
+        self.connection = duckdb.connect(self.database_path, read_only=True)
+        return True
+
+    def export(self, tables=None):
+        """Copy the stats tables, by default all of them, into the DuckDB file"""
+
+        # A new copy needs all tables of the reports
+        if tables is None or not os.path.exists(self.database_path):
+            tables = self.report_tables
+
+        with duckdb.connect(self.database_path) as connection:
+            with Database(self.config['statistics_db']) as db:
+                with db.cursor() as cursor:
+                    for table in tables:
+                        self.logger.info("Copying %s into %s.", table, self.database_path)
+                        self.export_table(cursor=cursor, connection=connection, table=table)
+
+        return True
+
+    def export_table(self, cursor=None, connection=None, table=None):
+        """Copy one stats table into DuckDB through a temporary CSV file"""
+
+        # Create the table with the column types of Postgres so nothing is guessed from
+        # the CSV file. Text is sorted without case like the reports from Postgres.
+        cursor.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position", (table,))
+        columns = ', '.join(
+            f'"{column_name}" {self.column_types.get(data_type, "VARCHAR COLLATE NOCASE")}'
+            for column_name, data_type in cursor.fetchall())
+
+        csv_fd, csv_file_path = tempfile.mkstemp(prefix=table + '.', suffix='.csv',
+                                                   dir=self.work_dir)
+        try:
+            # NULL is written as \N, so empty text stays empty text
+            with os.fdopen(csv_fd, 'wb') as csv_file:
+                with cursor.copy(sql.SQL("COPY {} TO STDOUT (FORMAT CSV, HEADER, NULL '\\N')").format(sql.Identifier(table))) as copy:
+                    for data in copy:
+                        csv_file.write(data)
+
+            escaped_file_path = csv_file_path.replace("'", "''")
+            connection.execute("BEGIN TRANSACTION")
+            connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+            connection.execute(f'CREATE TABLE "{table}" ({columns})')
+            connection.execute(f'COPY "{table}" FROM \'{escaped_file_path}\' ' +
+                               "(HEADER, NULL '\\N', ALLOW_QUOTED_NULLS false)")
+            connection.execute("COMMIT")
+        finally:
+            os.remove(csv_file_path)
+
+    def fetch_report(self, table=None, order_by=None):
+        """Get column names and an iterator over the rows of a stats table"""
+
+        query = f'SELECT * FROM "{table}" ORDER BY "{order_by}" ASC'
+        self.logger.debug(query)
+
+        result = self.connection.execute(query)
+        column_names = [col[0] for col in result.description]
+
+        return column_names, self.stream_rows(result=result, column_names=column_names)
+
+    def stream_rows(self, result=None, column_names=None):
+        """Yield the rows of a query result in batches"""
+
+        while True:
+            rows = result.fetchmany(self.itersize)
+            if not rows:
+                break
+
+            for row in rows:
+                yield dict(zip(column_names, row))
+
+    def copy_report_csv(self, table=None, order_by=None, output_file_path=None,
+                        column_map=None, excluded_columns=None):
+        """Save a stats table to a CSV file with COPY, renaming its columns in the query"""
+
+        if column_map is None:
+            column_map = {}
+        if excluded_columns is None:
+            excluded_columns = []
+
+        result = self.connection.execute(f'SELECT * FROM "{table}" LIMIT 0')
+        columns = ', '.join(f'"{col[0]}" AS "{column_map.get(col[0], col[0])}"'
+                            for col in result.description if col[0] not in excluded_columns)
+
+        escaped_file_path = output_file_path.replace("'", "''")
+        query = (f'COPY (SELECT {columns} FROM "{table}" ORDER BY "{order_by}" ASC) ' +
+                 f"TO '{escaped_file_path}' (HEADER, DELIMITER ',')")
+        self.logger.debug(query)
+        self.connection.execute(query)
+
+        self.logger.info("Saved report to CSV file %s.", output_file_path)
+        return output_file_path
+
+    def close(self):
+        """Close the DuckDB database"""
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def get_report_backend(config=None):
+    """Get the report backend set in the configuration"""
+
+    logger = logging.getLogger('dspace-reports')
+
+    report_backend = config.get('report_backend', 'postgres')
+    if report_backend == 'duckdb':
+        if duckdb is not None:
+            return DuckDBReportBackend(config=config)
+
+        logger.warning("The duckdb package is not installed. " +
+                       "Reading reports from the statistics database.")
+    elif report_backend != 'postgres':
+        logger.warning("Unrecognized report backend: %s. " +
+                       "Reading reports from the statistics database.", report_backend)
+
+    return PostgresReportBackend(config=config)
@@ -3,12 +3,13 @@
 import logging
 import re
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class DSpaceSolr():
     """Class for interacting with a DSpace 7+ Solr instance"""
 
-    def __init__(self, solr_server=None):
+    def __init__(self, solr_server=None, pool_size=10):
         # Ensure solr_server has trailing slash
         if solr_server[len(solr_server)-1] != '/':
             self.solr_server = solr_server + '/'
@@ -18,10 +19,17 @@ class DSpaceSolr():
         # Timeout in seconds for requests to Solr
         self.timeout = 120
 
-        # Create session
+        # Create session. The session can be shared by several indexer threads, so keep
+        # enough connections open for all of them.
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.request_headers = {'Content-type': 'application/json'}
 
+        # Statistics shards are looked up once per Solr object
+        self.statistics_shards = None
+
         self.logger = logging.getLogger('dspace-reports')
         self.logger.debug("Connecting to DSpace REST API:  %s.", self.solr_server)
         self.test_connection()
@@ -85,6 +93,9 @@ class DSpaceSolr():
     def get_statistics_shards(self):
         """Get Solr shards with statistics"""
 
+        if self.statistics_shards is not None:
+            return self.statistics_shards
+
         # Vars
         shards = str()
         shards = f"{self.solr_server}statistics"
@@ -117,6 +128,7 @@ class DSpaceSolr():
                 shards += f",{self.solr_server}{core}"
 
         self.logger.info("Using these shards to search for statistics: %s", shards)
+        self.statistics_shards = shards
         return shards
 
     def get_solr_server(self):
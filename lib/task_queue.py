@@ -0,0 +1,152 @@
+"""Class for sharing the tasks of an indexing run between worker processes"""
+
+import json
+import logging
+import threading
+
+from lib.database import Database
+
+
+class TaskQueue():
+    """Class for sharing the tasks of an indexing run between worker processes
+
+    Tasks are rows of the indexing_tasks table. Workers claim them with
+    SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers on any number of hosts
+    can take tasks without blocking each other. A task of a stage is only claimed once
+    every task of the earlier stages of the run is done. A running task whose worker
+    stopped sending heartbeats is claimed again, and a failed task is retried until it
+    was attempted max_attempts times.
+    """
+
+    # Tasks that can be claimed: waiting, or running without recent heartbeats, and not
+    # waiting for tasks of an earlier stage
+    claimable_condition = "t.run_id = %s AND t.attempts < %s AND (t.status = 'pending' OR (t.status = 'running' AND t.heartbeat_at < now() - make_interval(secs => %s))) AND NOT EXISTS (SELECT 1 FROM indexing_tasks p WHERE p.run_id = t.run_id AND p.stage < t.stage AND p.status <> 'done')"
+
+    def __init__(self, config=None, run_id=None, max_attempts=3, heartbeat_interval=30,
+                 task_timeout=300):
+        self.config = config
+        self.run_id = run_id
+        self.logger = logging.getLogger('dspace-reports')
+
+        # Number of times a task is attempted before it is marked as failed
+        self.max_attempts = max_attempts
+
+        # Seconds between heartbeats of a running task, and seconds without a heartbeat
+        # after which its worker is considered gone
+        self.heartbeat_interval = heartbeat_interval
+        self.task_timeout = task_timeout
+
+    def enqueue(self, tasks=None):
+        """Add (stage, task type, params) tasks, skipping tasks the run already has"""
+
+        if not tasks:
+            return
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.executemany("INSERT INTO indexing_tasks (run_id, stage, task_type, task_key, params) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (run_id, task_type, task_key) DO NOTHING", [(self.run_id, stage, task_type, self.get_task_key(params), json.dumps(params)) for stage, task_type, params in tasks])
+                db.commit()
+
+        self.logger.debug("Queued %s indexing tasks.", str(len(tasks)))
+
+    def get_task_key(self, params=None):
+        """Get the key identifying a task among the tasks of its type"""
+
+        return json.dumps(params, sort_keys=True)
+
+    def claim(self, worker=None):
+        """Claim the next task that can run, or return None"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                # Tasks whose worker was lost during their last attempt are not retried
+                cursor.execute("UPDATE indexing_tasks SET status = 'failed', error = 'Worker stopped sending heartbeats', finished_at = now() WHERE run_id = %s AND status = 'running' AND attempts >= %s AND heartbeat_at < now() - make_interval(secs => %s)", (self.run_id, self.max_attempts, self.task_timeout))
+
+                cursor.execute("UPDATE indexing_tasks SET status = 'running', attempts = attempts + 1, worker = %s, heartbeat_at = now(), error = NULL WHERE task_id = (SELECT t.task_id FROM indexing_tasks t WHERE " + self.claimable_condition + " ORDER BY t.stage, t.task_id LIMIT 1 FOR UPDATE SKIP LOCKED) RETURNING task_id, task_type, params, attempts", (worker, self.run_id, self.max_attempts, self.task_timeout))
+                row = cursor.fetchone()
+                db.commit()
+
+        if row is None:
+            return None
+
+        task_id, task_type, params, attempts = row
+        self.logger.info("Claimed indexing task %s: %s %s (attempt %s).", str(task_id),
+                         task_type, params, str(attempts))
+        return {'task_id': task_id, 'task_type': task_type, 'params': json.loads(params),
+                'attempts': attempts}
+
+    def heartbeat(self, task_id=None):
+        """Record that the worker of a task is still running it"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("UPDATE indexing_tasks SET heartbeat_at = now() WHERE task_id = %s AND status = 'running'", (task_id,))
+                db.commit()
+
+    def start_heartbeat(self, task_id=None):
+        """Send heartbeats for a task in a background thread until the returned event is set"""
+
+        stopped = threading.Event()
+
+        def send_heartbeats():
+            while not stopped.wait(self.heartbeat_interval):
+                try:
+                    self.heartbeat(task_id=task_id)
+                except Exception as err: # pylint: disable=broad-exception-caught
+                    self.logger.warning("Unable to send heartbeat of task %s: %s",
+                                        str(task_id), err)
+
+        threading.Thread(target=send_heartbeats, daemon=True).start()
+        return stopped
+
+    def complete(self, task_id=None):
+        """Mark a task as done"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("UPDATE indexing_tasks SET status = 'done', finished_at = now() WHERE task_id = %s", (task_id,))
+                db.commit()
+
+    def fail(self, task_id=None, error=None):
+        """Return a failed task to the queue, or mark it as failed after its last attempt"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("UPDATE indexing_tasks SET status = CASE WHEN attempts < %s THEN 'pending' ELSE 'failed' END, error = %s, finished_at = now() WHERE task_id = %s RETURNING status", (self.max_attempts, str(error), task_id))
+                row = cursor.fetchone()
+                db.commit()
+
+        if row is not None and row[0] == 'failed':
+            self.logger.error("Indexing task %s failed after %s attempts: %s", str(task_id),
+                              str(self.max_attempts), error)
+        else:
+            self.logger.warning("Indexing task %s failed and will be retried: %s",
+                                str(task_id), error)
+
+    def retry_failed(self):
+        """Return the failed tasks of the run to the queue with new attempts"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("UPDATE indexing_tasks SET status = 'pending', attempts = 0 WHERE run_id = %s AND status = 'failed'", (self.run_id,))
+                db.commit()
+
+    def get_status_counts(self):
+        """Get the number of tasks of the run in each status"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT status, count(*) FROM indexing_tasks WHERE run_id = %s GROUP BY status", (self.run_id,))
+                return dict(cursor.fetchall())
+
+    def is_finished(self):
+        """Check if no task of the run is running or can still be claimed
+
+        Tasks waiting for a failed task of an earlier stage can never be claimed, so the
+        queue is also finished when they are left.
+        """
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM indexing_tasks t WHERE (t.run_id = %s AND t.status = 'running') OR (" + self.claimable_condition + ")", (self.run_id, self.run_id, self.max_attempts, self.task_timeout))
+                return cursor.fetchone()[0] == 0
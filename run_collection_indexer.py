@@ -4,6 +4,8 @@ import argparse
 import logging
 import sys
 
+from database_manager import DatabaseManager
+from lib.report_backend import get_report_backend
 from lib.util import Utilities
 from dspace_reports.collection_indexer import CollectionIndexer
 
@@ -11,7 +13,7 @@ from dspace_reports.collection_indexer import CollectionIndexer
 class RunCollectionIndexer():
     """Class for indexing collection statistics"""
 
-    def __init__(self, config=None, logger=None):
+    def __init__(self, config=None, logger=None, scope=None):
         if config is None:
             print("ERROR: A configuration file required to create the stats indexer.")
             sys.exit(1)
@@ -19,6 +21,9 @@ class RunCollectionIndexer():
         self.config = config
         self.solr_server = config['solr_server']
 
+        # Community or collection UUIDs or handles of the subtrees to index, if any
+        self.scope = scope
+
         # Set up logging
         if logger is not None:
             self.logger = logger
@@ -31,9 +36,25 @@ class RunCollectionIndexer():
         # Create collections stats indexer
         collection_indexer = CollectionIndexer(config=self.config)
 
+        # Only index the given subtrees
+        if self.scope:
+            collection_indexer.set_scope(identifiers=self.scope)
+
         # Index collections stats from Solr
         collection_indexer.index()
 
+        # Views and downloads were skipped by the indexer and are summed from the items
+        database_manager = DatabaseManager(config=self.config)
+        if self.config.get('sql_rollups', False):
+            database_manager.rollup_statistics(self.config, self.logger, entity_type='collection',
+                                               entity_ids=collection_indexer.scope_ids)
+
+        # Update the planner statistics of the indexed table
+        database_manager.analyze_tables(self.config, self.logger, tables=['collection_stats'])
+
+        # Copy the new statistics into the local report database
+        get_report_backend(config=self.config).export(tables=['collection_stats'])
+
 
 def main():
     """Main function"""
@@ -46,6 +67,9 @@ def main():
                         default="config/application.yml", help="Configuration file")
     parser.add_argument("-o", "--output_dir", dest="output_dir", action='store', type=str,
                         help="Directory for results files.")
+    parser.add_argument("-s", "--scope", dest="scope", action='store', type=str, nargs='+',
+                        help="Only index the subtrees of these community or collection " +
+                        "UUIDs or handles.")
 
     args = parser.parse_args()
 
@@ -84,7 +108,7 @@ def main():
         sys.exit(1)
 
     # Create stats indexer
-    indexer = RunCollectionIndexer(config=config, logger=logger)
+    indexer = RunCollectionIndexer(config=config, logger=logger, scope=args.scope)
 
     # Get item statistics from Solr
     indexer.run()
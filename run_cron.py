@@ -3,6 +3,8 @@
 import argparse
 import sys
 
+from lib.api import DSpaceRestApi
+from lib.solr import DSpaceSolr
 from lib.util import Utilities
 from run_indexer import RunIndexer
 from run_reports import RunReports
@@ -22,6 +24,8 @@ def main():
     parser.add_argument("-e", "--send_email", dest="send_email",
                         action='store_true',
                         help="Send email with stats reports?")
+    parser.add_argument("-r", "--resume", dest="resume", action='store_true',
+                        help="Resume the last unfinished indexing run.")
 
     args = parser.parse_args()
 
@@ -61,8 +65,13 @@ def main():
     # Store send email parameter
     send_email = args.send_email
 
+    # Log in to the REST API and connect to Solr once for all indexers
+    rest = DSpaceRestApi(rest_server=config['rest_server'])
+    pool_size = config.get('indexer_workers', 1) * config.get('solr_workers', 2)
+    solr = DSpaceSolr(solr_server=config['solr_server'], pool_size=max(pool_size, 10))
+
     # Create stats indexer
-    indexer = RunIndexer(config=config, logger=logger)
+    indexer = RunIndexer(config=config, logger=logger, resume=args.resume, rest=rest, solr=solr)
 
     # Get item statistics from Solr
     indexer.run()
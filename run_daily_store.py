@@ -0,0 +1,134 @@
+"""Class for filling and reading the local daily statistics store"""
+
+import argparse
+import csv
+import logging
+import sys
+
+from datetime import date
+
+from lib.util import Utilities
+from dspace_reports.community_indexer import CommunityIndexer
+from dspace_reports.collection_indexer import CollectionIndexer
+from dspace_reports.item_indexer import ItemIndexer
+
+
+class RunDailyStore():
+    """Class for filling and reading the local daily statistics store"""
+
+    # Indexers with the facet specs of each entity type
+    indexer_classes = {
+        'community': CommunityIndexer,
+        'collection': CollectionIndexer,
+        'item': ItemIndexer
+    }
+
+    def __init__(self, config=None, logger=None, entity_type='item'):
+        if config is None:
+            print("ERROR: A configuration file required to use the daily store.")
+            sys.exit(1)
+
+        self.config = config
+        self.entity_type = entity_type
+
+        # Set up logging
+        if logger is not None:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger('dspace-reports')
+
+        self.indexer = self.indexer_classes[entity_type](config=config, logger=self.logger)
+
+    def fill(self, start_day=None, end_day=None):
+        """Fill (or back-fill) the daily counts from start_day up to, not including, end_day"""
+
+        for facet_spec in self.indexer.facet_specs:
+            store = self.indexer.get_daily_store(facet_spec=facet_spec)
+            if store is None:
+                return
+
+            self.indexer.fill_daily_store(facet_spec=facet_spec, store=store,
+                                          start_day=start_day, end_day=end_day)
+
+    def save_window_sums(self, start_day=None, end_day=None, output_file_path=None):
+        """Save the counts from start_day up to, not including, end_day to a CSV file"""
+
+        headers = ['entity_id']
+        sums = {}
+        for facet_spec in self.indexer.facet_specs:
+            store = self.indexer.get_daily_store(facet_spec=facet_spec)
+            if store is None:
+                return None
+
+            headers.append(facet_spec['metric'])
+            uuids, counts = store.window_sums(start_day=start_day, end_day=end_day)
+            for uuid, count in zip(uuids, counts.tolist()):
+                sums.setdefault(uuid, {'entity_id': uuid})[facet_spec['metric']] = count
+
+        with open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=headers, restval=0,
+                                    dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+            writer.writeheader()
+            writer.writerows(sums.values())
+
+        self.logger.info("Saved daily store counts to CSV file %s.", output_file_path)
+        return output_file_path
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(
+                    prog='Daily Store',
+                    description='Commands to fill and read the local daily statistics store')
+
+    parser.add_argument("-c", "--config", dest="config_file", action='store', type=str,
+                        default="config/application.yml", help="Configuration file")
+    parser.add_argument("-t", "--entity_type", dest="entity_type", action='store', type=str,
+                        choices=['community', 'collection', 'item'], default='item',
+                        help="Entity type of the counts.")
+    parser.add_argument("-s", "--start", dest="start", action='store', type=str,
+                        help="First day (YYYY-MM-DD).")
+    parser.add_argument("-e", "--end", dest="end", action='store', type=str,
+                        help="Day after the last day (YYYY-MM-DD), default today.")
+    parser.add_argument("-f", "--fill", dest="fill", action='store_true',
+                        help="Fill the daily store from Solr for the days.")
+    parser.add_argument("-o", "--output_file", dest="output_file", action='store', type=str,
+                        help="Save the counts of the days to this CSV file.")
+
+    args = parser.parse_args()
+
+    # Check required options fields
+    if args.start is None or (not args.fill and args.output_file is None):
+        parser.print_help()
+        parser.error("Must specify a start day and --fill or an output file.")
+
+    start_day = date.fromisoformat(args.start)
+    end_day = date.today()
+    if args.end is not None:
+        end_day = date.fromisoformat(args.end)
+
+    # Create utilities object
+    utilities = Utilities()
+
+    # Load config
+    print("Loading configuration from file: %s", args.config_file)
+    config = utilities.load_config(args.config_file)
+    if not config:
+        print("ERROR: Unable to load configuration.")
+        sys.exit(1)
+
+    # Set up logging
+    logger = utilities.load_logger(config=config)
+
+    daily_store = RunDailyStore(config=config, logger=logger, entity_type=args.entity_type)
+
+    if args.fill:
+        daily_store.fill(start_day=start_day, end_day=end_day)
+
+    if args.output_file is not None:
+        daily_store.save_window_sums(start_day=start_day, end_day=end_day,
+                                     output_file_path=args.output_file)
+
+if __name__ == "__main__":
+    main()
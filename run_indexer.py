@@ -4,7 +4,15 @@ import argparse
 import logging
 import sys
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from database_manager import DatabaseManager
+from lib.api import DSpaceRestApi
+from lib.checkpoint import Checkpoints
+from lib.report_backend import get_report_backend
+from lib.solr import DSpaceSolr
 from lib.util import Utilities
+from run_task_worker import RunTaskWorker
 
 from dspace_reports.repository_indexer import RepositoryIndexer
 from dspace_reports.community_indexer import CommunityIndexer
@@ -15,14 +23,29 @@ from dspace_reports.item_indexer import ItemIndexer
 class RunIndexer():
     """Class for indexing all statistics"""
 
-    def __init__(self, config=None, logger=None):
+    def __init__(self, config=None, logger=None, resume=False, rest=None, solr=None):
         if config is None:
             print('A configuration file required to create the stats indexer.')
             sys.exit(1)
 
+        # Refuse options the task queue cannot run before a run is started
+        if config.get('task_queue', False):
+            local_store_options = RunTaskWorker.get_local_store_options(config)
+            if local_store_options:
+                print(f"ERROR: {' and '.join(local_store_options)} cannot be used with " +
+                      "task_queue, as the daily store is local to one host.")
+                sys.exit(1)
+
         self.config = config
         self.solr_server = config['solr_server']
 
+        # Continue the last unfinished run instead of starting over
+        self.resume = resume
+
+        # REST API and Solr objects shared by all indexers, created on first use
+        self.rest = rest
+        self.solr = solr
+
         # Set up logging
         if logger is not None:
             self.logger = logger
@@ -34,32 +57,157 @@ class RunIndexer():
 
         self.logger.info("Begin running all indexing.")
 
-        # Create items stats indexer
-        repository_indexer = RepositoryIndexer(config=self.config, logger=self.logger)
-
-        # Index repository stats from Solr
-        repository_indexer.index()
-
-        # Create communities stats indexer
-        community_indexer = CommunityIndexer(config=self.config, logger=self.logger)
-
-        # Index communities stats from Solr
-        community_indexer.index()
-
-        # Create collections stats indexer
-        collection_indexer = CollectionIndexer(config=self.config, logger=self.logger)
+        database_manager = DatabaseManager(config=self.config)
+
+        # Record the progress of this run so that it can be resumed if it is interrupted
+        database_manager.create_run_state_tables(self.config, self.logger)
+        checkpoints = Checkpoints(config=self.config)
+        resumed = checkpoints.start_run(resume=self.resume)
+
+        # Incremental runs continue from the watermarks of the previous run
+        if self.config.get('incremental', False):
+            database_manager.create_watermark_table(self.config, self.logger)
+
+        # Keep the statistics of this run in the long-format history
+        record_history = self.config.get('record_history', False)
+        if record_history:
+            database_manager.create_history_tables(self.config, self.logger)
+            database_manager.create_history_partition(self.config, self.logger)
+
+        # Build the statistics of this run in staging tables so that reports keep reading
+        # the previous run until the new tables are complete
+        use_staging_tables = self.config.get('use_staging_tables', False)
+        indexer_config = self.config
+        if use_staging_tables:
+            if not resumed:
+                database_manager.create_staging_tables(
+                    self.config, self.logger,
+                    unlogged=self.config.get('unlogged_staging_tables', False))
+            indexer_config = database_manager.staging_config(self.config)
+
+        # Log in to the REST API and connect to Solr once for all indexers
+        self.create_clients()
+
+        # Share the indexing tasks with workers in other processes or on other hosts
+        if self.config.get('task_queue', False):
+            if not self.run_task_queue(indexer_config=indexer_config, checkpoints=checkpoints,
+                                       resumed=resumed):
+                return
+        elif not self.run_indexers(indexer_config=indexer_config, checkpoints=checkpoints):
+            return
+
+        # Sum collection and community views and downloads from the item statistics
+        if self.config.get('sql_rollups', False):
+            database_manager.rollup_statistics(indexer_config, self.logger)
+
+        # Replace the live statistics tables with the ones built during this run. If the
+        # swap fails the run stays unfinished so that it can be resumed.
+        if use_staging_tables:
+            if not database_manager.swap_staging_tables(self.config, self.logger):
+                self.logger.error("Indexing run was not finished. Run again with --resume.")
+                return
+        else:
+            # Make sure the report indexes exist and update the planner statistics
+            database_manager.create_indexes(self.config, self.logger)
+            database_manager.analyze_tables(self.config, self.logger)
 
-        # Index collections stats from Solr
-        collection_indexer.index()
+        # Copy the new statistics into the local report database once for all reports
+        get_report_backend(config=self.config).export()
 
-        # Create items stats indexer
-        item_indexer = ItemIndexer(config=self.config, logger=self.logger)
+        checkpoints.finish_run()
 
-        # Index items stats from Solr
-        item_indexer.index()
+        if record_history:
+            database_manager.prune_history(
+                self.config, self.logger,
+                retention_months=self.config.get('history_retention_months', 0))
 
         self.logger.info("Finished running all indexing.")
 
+    def run_indexers(self, indexer_config=None, checkpoints=None):
+        """Run the stats indexers, returning False if any of them failed"""
+
+        # Index repository, communities, collections and items stats from Solr. The indexers
+        # write separate tables, so several of them can run at the same time.
+        indexer_classes = [RepositoryIndexer, CommunityIndexer, CollectionIndexer, ItemIndexer]
+        indexer_workers = self.config.get('indexer_workers', 1)
+        failed_indexers = []
+        with ThreadPoolExecutor(max_workers=indexer_workers) as executor:
+            futures = {}
+            for indexer_class in indexer_classes:
+                future = executor.submit(self.run_indexer, indexer_class=indexer_class,
+                                         indexer_config=indexer_config, checkpoints=checkpoints)
+                futures[future] = indexer_class.__name__
+
+            # A failed indexer does not stop the others
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (Exception, SystemExit) as err: # pylint: disable=broad-exception-caught
+                    self.logger.error("%s failed: %s", futures[future], err)
+                    failed_indexers.append(futures[future])
+
+        # The run stays unfinished so that the failed indexers can be resumed
+        if len(failed_indexers) > 0:
+            self.logger.error("Indexing run was not finished because of failed indexers: %s. " +
+                              "Run again with --resume.", ', '.join(sorted(failed_indexers)))
+            return False
+
+        return True
+
+    def run_task_queue(self, indexer_config=None, checkpoints=None, resumed=False):
+        """Queue the indexing tasks and work on them, returning False if any of them failed"""
+
+        task_worker = RunTaskWorker(config=self.config, logger=self.logger,
+                                    checkpoints=checkpoints, indexer_config=indexer_config,
+                                    rest=self.rest, solr=self.solr)
+
+        # Failed tasks of a resumed run get new attempts
+        if resumed:
+            task_worker.queue.retry_failed()
+        task_worker.enqueue_tasks()
+
+        # Work on the tasks together with any run_task_worker.py processes
+        indexer_workers = self.config.get('indexer_workers', 1)
+        with ThreadPoolExecutor(max_workers=indexer_workers) as executor:
+            futures = [executor.submit(task_worker.work) for _ in range(indexer_workers)]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err: # pylint: disable=broad-exception-caught
+                    self.logger.error("Task worker failed: %s", err)
+
+        # The run stays unfinished so that the failed tasks can be resumed
+        status_counts = task_worker.queue.get_status_counts()
+        if any(status != 'done' for status in status_counts):
+            self.logger.error("Indexing run was not finished because of failed tasks: %s. " +
+                              "Run again with --resume.", status_counts)
+            return False
+
+        return True
+
+    def create_clients(self):
+        """Create the REST API and Solr objects shared by all indexers"""
+
+        if self.rest is None:
+            self.rest = DSpaceRestApi(rest_server=self.config['rest_server'])
+
+        if self.solr is None:
+            # Every indexer thread may fetch Solr pages with its own workers
+            pool_size = (self.config.get('indexer_workers', 1) *
+                         self.config.get('solr_workers', 2))
+            self.solr = DSpaceSolr(solr_server=self.solr_server, pool_size=max(pool_size, 10))
+
+    def run_indexer(self, indexer_class=None, indexer_config=None, checkpoints=None):
+        """Create and run one stats indexer"""
+
+        self.logger.info("Begin running %s.", indexer_class.__name__)
+
+        indexer = indexer_class(config=indexer_config, logger=self.logger,
+                                checkpoints=checkpoints, rest=self.rest, solr=self.solr)
+        indexer.index()
+
+        self.logger.info("Finished running %s.", indexer_class.__name__)
+
 def main():
     """Main function"""
 
@@ -71,6 +219,8 @@ def main():
                         default="config/application.yml", help="Configuration file")
     parser.add_argument("-o", "--output_dir", dest="output_dir", action='store', type=str,
                         help="Directory for results files.")
+    parser.add_argument("-r", "--resume", dest="resume", action='store_true',
+                        help="Resume the last unfinished indexing run.")
 
     args = parser.parse_args()
 
@@ -108,7 +258,7 @@ def main():
         sys.exit(0)
 
     # Create stats indexer
-    indexer = RunIndexer(config=config, logger=logger)
+    indexer = RunIndexer(config=config, logger=logger, resume=args.resume)
 
     # Get item statistics from Solr
     indexer.run()
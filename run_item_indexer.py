@@ -4,6 +4,8 @@ import argparse
 import logging
 import sys
 
+from database_manager import DatabaseManager
+from lib.report_backend import get_report_backend
 from lib.util import Utilities
 from dspace_reports.item_indexer import ItemIndexer
 
@@ -11,13 +13,19 @@ from dspace_reports.item_indexer import ItemIndexer
 class RunItemIndexer():
     """Class for indexing item statistics"""
 
-    def __init__(self, config=None, logger=None):
+    def __init__(self, config=None, logger=None, partition=None, partitions=None,
+                 scope=None):
         if config is None:
             print("ERROR: A configuration file required to create the stats indexer.")
             sys.exit(1)
 
         self.config = config
         self.solr_server = config['solr_server']
+        self.partition = partition
+        self.partitions = partitions
+
+        # Community or collection UUIDs or handles of the subtrees to index, if any
+        self.scope = scope
 
         # Set up logging
         if logger is not None:
@@ -29,11 +37,23 @@ class RunItemIndexer():
         """Function to run item indexer"""
 
         # Create items stats indexer
-        item_indexer = ItemIndexer(config=self.config, logger=self.logger)
+        item_indexer = ItemIndexer(config=self.config, logger=self.logger,
+                                   partition=self.partition, partitions=self.partitions)
+
+        # Only index the given subtrees
+        if self.scope:
+            item_indexer.set_scope(identifiers=self.scope)
 
         # Index items stats from Solr
         item_indexer.index()
 
+        # Update the planner statistics of the indexed table
+        database_manager = DatabaseManager(config=self.config)
+        database_manager.analyze_tables(self.config, self.logger, tables=['item_stats'])
+
+        # Copy the new statistics into the local report database
+        get_report_backend(config=self.config).export(tables=['item_stats'])
+
 
 def main():
     """Main function"""
@@ -46,6 +66,13 @@ def main():
                         default="config/application.yml", help="Configuration file")
     parser.add_argument("-o", "--output_dir", dest="output_dir", action='store', type=str,
                         help="Directory for results files.")
+    parser.add_argument("-s", "--scope", dest="scope", action='store', type=str, nargs='+',
+                        help="Only index the subtrees of these community or collection " +
+                        "UUIDs or handles.")
+    parser.add_argument("-p", "--partition", dest="partition", action='store', type=int,
+                        help="Slice of the item UUIDs to index (1 to the number of partitions).")
+    parser.add_argument("-n", "--partitions", dest="partitions", action='store', type=int,
+                        help="Number of slices the item UUIDs are split into.")
 
     args = parser.parse_args()
 
@@ -57,6 +84,10 @@ def main():
         parser.print_help()
         parser.error("Must specify an output directory.")
 
+    if (args.partition is None) != (args.partitions is None):
+        parser.print_help()
+        parser.error("Must specify both a partition and the number of partitions.")
+
     # Load config
     print("Loading configuration from file: %s", args.config_file)
     config = utilities.load_config(args.config_file)
@@ -84,7 +115,8 @@ def main():
         sys.exit(1)
 
     # Create stats indexer
-    indexer = RunItemIndexer(config=config, logger=logger)
+    indexer = RunItemIndexer(config=config, logger=logger, partition=args.partition,
+                             partitions=args.partitions, scope=args.scope)
 
     # Get item statistics from Solr
     indexer.run()
@@ -5,12 +5,10 @@ from datetime import datetime
 import logging
 import sys
 
-from psycopg import sql
-
 from database_manager import DatabaseManager
-from lib.database import Database
 from lib.emailer import Emailer
 from lib.output import Output
+from lib.report_backend import get_report_backend
 from lib.util import Utilities
 
 
@@ -37,6 +35,9 @@ class RunReports():
          # Create email object
         self.emailer = Emailer(config=config)
 
+        # Create backend to read the stats tables from
+        self.backend = get_report_backend(config=config)
+
         # Set up logging
         if logger is not None:
             self.logger = logger
@@ -71,18 +72,30 @@ class RunReports():
             }
         ]
 
+        # Load the stats tables into the report backend
+        self.backend.prepare()
+
         # Create CSV files of each stats report
         csv_report_files = []
-        for report in reports:
-            csv_report_file = self.create_csv_report(report=report)
-            self.logger.info("Created CSV report file: %s.", csv_report_file)
-
-            # Convert column names to human readable text
-            csv_report_files.append(csv_report_file)
+        excel_from_database = self.config.get('report_excel_from_database', False)
+        excel_report_file = None
+        try:
+            for report in reports:
+                csv_report_file = self.create_csv_report(report=report)
+                self.logger.info("Created CSV report file: %s.", csv_report_file)
+                csv_report_files.append(csv_report_file)
+
+            # Stream the rows of each stats report into the Excel report file
+            if excel_from_database:
+                self.logger.info("Creating Excel file from the stats tables.")
+                excel_report_file = self.create_excel_report_from_database(reports=reports)
+        finally:
+            self.backend.close()
 
         # Create Excel report file from CSV files
-        self.logger.info("Creating Excel file with CSV report files.")
-        excel_report_file = self.create_excel_report(csv_report_files)
+        if not excel_from_database:
+            self.logger.info("Creating Excel file with CSV report files.")
+            excel_report_file = self.create_excel_report(csv_report_files)
 
         if self.config['create_zip_archive']:
             # Create ZIP archive with Excel report file
@@ -110,36 +123,27 @@ class RunReports():
             self.logger.error("Must specify a report.")
             return None
 
-        # Vars
-        column_names = []
-        data = []
-
         self.logger.debug("Creating CSV file for report %s...", report['table'])
 
-        with Database(self.config['statistics_db']) as db:
-            with db.cursor() as cursor:
-                self.logger.debug(cursor.mogrify(sql.SQL("SELECT * FROM {} ORDER BY {} ASC").format(sql.Identifier(report['table']), sql.Identifier(report['orderBy'],))))
-                cursor.execute(sql.SQL("SELECT * FROM {} ORDER BY {} ASC").format(sql.Identifier(report['table']), sql.Identifier(report['orderBy'],)))
-
-                desc = cursor.description
-                column_names = [col[0] for col in desc]
-                self.logger.debug("Report has %s columns.", str(len(column_names)))
-                data = [dict(zip(column_names, row))
-                        for row in cursor.fetchall()]
-
-        self.logger.debug("Report has %s rows.", str(len(data)))
-
-        # Save raw database table in a CSV file
+        # Let the database write the CSV file with human readable column names
+        if self.backend.copy_csv or self.config.get('report_csv_copy', False):
+            return self.backend.copy_report_csv(
+                table=report['table'], order_by=report['orderBy'],
+                output_file_path=self.output_dir + report['name'] + '.csv',
+                column_map=self.get_column_map(report_name=report['name']),
+                excluded_columns=self.output.excluded_columns)
+
+        # Rows are streamed from the backend into the CSV file
+        column_names, data = self.backend.fetch_report(table=report['table'],
+                                                      order_by=report['orderBy'])
+        self.logger.debug("Report has %s columns.", str(len(column_names)))
+
+        # Save the table in a CSV file with human readable column names based on mappings
+        # in DatabaseManager
         report_csv_file = self.output.save_report_csv_file(
             output_file_path=self.output_dir + report['name'] + '.csv',
-            headers=column_names, data=data)
-
-        # Convert column names to human readable text based on mappings in DatabaseManager
-        column_names_new = self.map_column_names(report_name=report['name'],
-                                                 column_names=column_names)
-        report_csv_file = self.output.update_header_report_csv_file(
-            input_file_path=report_csv_file, headers_old=column_names,
-            headers_new=column_names_new)
+            headers=column_names, data=data,
+            column_map=self.get_column_map(report_name=report['name']))
 
         return report_csv_file
 
@@ -163,6 +167,34 @@ class RunReports():
         self.logger.error("There was an error saving the Excel file.")
         return False
 
+    def create_excel_report_from_database(self, reports=None):
+        """Create Excel report from the rows of the report backend"""
+
+        if reports is None or len(reports) == 0:
+            self.logger.warning("No reports to create Excel file.")
+            return False
+
+        def worksheets():
+            """Fetch the rows of each report when its worksheet is written"""
+
+            for report in reports:
+                column_names, data = self.backend.fetch_report(table=report['table'],
+                                                              order_by=report['orderBy'])
+                yield (report['name'], column_names, data,
+                       self.get_column_map(report_name=report['name']))
+
+        output_file_path = (self.output_dir +
+                            datetime.now().strftime('dspace-reports_%Y-%m-%d_%H-%M-%S.xlsx'))
+        excel_report_file = self.output.save_report_excel_file_from_rows(
+            output_file_path=output_file_path, worksheets=worksheets())
+        if excel_report_file:
+            self.logger.info("Finished saving Excel file to %s.",
+                             excel_report_file)
+            return excel_report_file
+
+        self.logger.error("There was an error saving the Excel file.")
+        return False
+
     def create_zip_archive(self, excel_report_file=None):
         """Create ZIP file"""
 
@@ -184,12 +216,8 @@ class RunReports():
         self.logger.error("There was an error saving the ZIP archive.")
         return False
 
-    def map_column_names(self, report_name=None, column_names=None):
-        """Map column names"""
-
-        if report_name is None or column_names is None:
-            self.logger.error("One or more parameters missing to map table columns.")
-            return False
+    def get_column_map(self, report_name=None):
+        """Get the human readable column names of a report"""
 
         column_map = None
         if report_name == 'repository':
@@ -203,14 +231,7 @@ class RunReports():
         else:
             self.logger.error('Unrecognized report name.')
 
-        if column_map is not None:
-            for i, column_name in enumerate(column_names):
-                self.logger.debug("Looking at column name: %s.", column_names[i])
-                if column_name in column_map:
-                    self.logger.debug("Changing column name to %s.", column_map[column_name])
-                    column_names[i] = column_map[column_name]
-
-        return column_names
+        return column_map
 
 
 def main():
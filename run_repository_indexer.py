@@ -4,6 +4,8 @@ import argparse
 import logging
 import sys
 
+from database_manager import DatabaseManager
+from lib.report_backend import get_report_backend
 from lib.util import Utilities
 from dspace_reports.repository_indexer import RepositoryIndexer
 
@@ -34,6 +36,13 @@ class RunRepositoryIndexer():
         # Index repository stats from Solr
         repository_indexer.index()
 
+        # Update the planner statistics of the indexed table
+        database_manager = DatabaseManager(config=self.config)
+        database_manager.analyze_tables(self.config, self.logger, tables=['repository_stats'])
+
+        # Copy the new statistics into the local report database
+        get_report_backend(config=self.config).export(tables=['repository_stats'])
+
 
 def main():
     """Main function"""
@@ -0,0 +1,278 @@
+"""Class for running the queued tasks of an indexing run"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+
+from time import sleep
+
+from database_manager import DatabaseManager
+from lib.api import DSpaceRestApi
+from lib.checkpoint import Checkpoints
+from lib.solr import DSpaceSolr
+from lib.task_queue import TaskQueue
+from lib.util import Utilities
+
+from dspace_reports.repository_indexer import RepositoryIndexer
+from dspace_reports.community_indexer import CommunityIndexer
+from dspace_reports.collection_indexer import CollectionIndexer
+from dspace_reports.item_indexer import ItemIndexer
+
+
+class RunTaskWorker():
+    """Class for running the queued tasks of an indexing run
+
+    The tasks of a run are, in stages:
+        1. the repository, the communities, the collections and slices of the items
+        2. the views and downloads of every facet spec and time period, which split
+           themselves into
+        3. ranges of facet pages
+    """
+
+    # Indexers with the facet specs of each entity type
+    indexer_classes = {
+        'community': CommunityIndexer,
+        'collection': CollectionIndexer,
+        'item': ItemIndexer
+    }
+
+    def __init__(self, config=None, logger=None, checkpoints=None, indexer_config=None,
+                 rest=None, solr=None):
+        if config is None:
+            print("ERROR: A configuration file required to run indexing tasks.")
+            sys.exit(1)
+
+        # The daily store is a local file, but tasks can run on any host
+        local_store_options = self.get_local_store_options(config)
+        if local_store_options:
+            print(f"ERROR: {' and '.join(local_store_options)} cannot be used with the " +
+                  "task queue, as the daily store is local to one host.")
+            sys.exit(1)
+
+        self.config = config
+
+        # Configuration of the indexers, e.g. writing to the staging tables
+        self.indexer_config = indexer_config if indexer_config is not None else config
+
+        # Set up logging
+        if logger is not None:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger('dspace-reports')
+
+        self.checkpoints = checkpoints
+        self.rest = rest
+        self.solr = solr
+
+        # Number of slices the item UUIDs are split into, and facet pages per task
+        self.item_partitions = config.get('task_item_partitions', 16)
+        self.facet_pages_per_task = config.get('task_facet_pages', 50)
+
+        # Seconds to wait before looking for new tasks while other workers are busy
+        self.poll_interval = config.get('task_poll_interval', 10)
+
+        self.queue = TaskQueue(config=config, run_id=checkpoints.run_id,
+                               max_attempts=config.get('task_max_attempts', 3),
+                               heartbeat_interval=config.get('task_heartbeat_interval', 30),
+                               task_timeout=config.get('task_timeout', 300))
+
+    @staticmethod
+    def get_local_store_options(config=None):
+        """Get the enabled options that keep statistics in the daily store of one host"""
+
+        return [option for option in ['daily_store', 'incremental']
+                if config.get(option, False)]
+
+    def enqueue_tasks(self):
+        """Queue the first two stages of tasks of the run"""
+
+        tasks = [(1, 'repository', {}), (1, 'communities', {}), (1, 'collections', {})]
+        for partition in range(1, self.item_partitions + 1):
+            tasks.append((1, 'items', {'partition': partition,
+                                       'partitions': self.item_partitions}))
+
+        # Collection and community views and downloads are summed from item statistics
+        entity_types = ['community', 'collection', 'item']
+        if self.config.get('sql_rollups', False):
+            entity_types = ['item']
+
+        # Histograms are fetched for all time periods at once
+        whole_facets = self.config.get('histogram_mode', False)
+
+        self.create_clients()
+        for entity_type in entity_types:
+            indexer = self.create_indexer(indexer_class=self.indexer_classes[entity_type])
+            for facet_spec in indexer.facet_specs:
+                if whole_facets:
+                    tasks.append((2, 'facets', {'entity_type': entity_type,
+                                                'phase': facet_spec['phase']}))
+                    continue
+
+                for time_period in indexer.time_periods:
+                    tasks.append((2, 'facet', {'entity_type': entity_type,
+                                               'phase': facet_spec['phase'],
+                                               'time_period': time_period}))
+
+        self.queue.enqueue(tasks=tasks)
+
+    def create_clients(self):
+        """Create the REST API and Solr objects shared by all tasks of this worker"""
+
+        if self.rest is None:
+            self.rest = DSpaceRestApi(rest_server=self.config['rest_server'])
+
+        if self.solr is None:
+            pool_size = (self.config.get('indexer_workers', 1) *
+                         self.config.get('solr_workers', 2))
+            self.solr = DSpaceSolr(solr_server=self.config['solr_server'],
+                                   pool_size=max(pool_size, 10))
+
+    def work(self):
+        """Run tasks until no task of the run is left"""
+
+        self.create_clients()
+
+        worker = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        while True:
+            task = self.queue.claim(worker=worker)
+            if task is None:
+                if self.queue.is_finished():
+                    break
+
+                # Wait for other workers to finish the tasks of the current stage
+                sleep(self.poll_interval)
+                continue
+
+            stopped = self.queue.start_heartbeat(task_id=task['task_id'])
+            try:
+                self.run_task(task_type=task['task_type'], params=task['params'])
+                self.queue.complete(task_id=task['task_id'])
+            except (Exception, SystemExit) as err: # pylint: disable=broad-exception-caught
+                self.queue.fail(task_id=task['task_id'], error=err)
+            finally:
+                stopped.set()
+
+    def create_indexer(self, indexer_class=None, **kwargs):
+        """Create an indexer of the run"""
+
+        return indexer_class(config=self.indexer_config, logger=self.logger,
+                             checkpoints=self.checkpoints, rest=self.rest, solr=self.solr,
+                             **kwargs)
+
+    def get_facet_spec(self, entity_type=None, phase=None):
+        """Get an indexer of an entity type and one of its facet specs"""
+
+        indexer = self.create_indexer(indexer_class=self.indexer_classes[entity_type])
+        for facet_spec in indexer.facet_specs:
+            if facet_spec['phase'] == phase:
+                return indexer, facet_spec
+
+        raise ValueError(f"Unknown facet spec: {phase}")
+
+    def run_task(self, task_type=None, params=None):
+        """Run one task"""
+
+        if task_type == 'repository':
+            self.create_indexer(indexer_class=RepositoryIndexer).index()
+        elif task_type == 'communities':
+            self.create_indexer(indexer_class=CommunityIndexer).index_communities(
+                with_facets=False)
+        elif task_type == 'collections':
+            self.create_indexer(indexer_class=CollectionIndexer).index_collections(
+                with_facets=False)
+        elif task_type == 'items':
+            self.create_indexer(indexer_class=ItemIndexer, partition=params['partition'],
+                                partitions=params['partitions']).index_items(with_facets=False)
+        elif task_type == 'facets':
+            indexer, facet_spec = self.get_facet_spec(entity_type=params['entity_type'],
+                                                      phase=params['phase'])
+            indexer.index_facets(facet_specs=[facet_spec])
+        elif task_type == 'facet':
+            self.split_facet(params=params)
+        elif task_type == 'facet_pages':
+            indexer, facet_spec = self.get_facet_spec(entity_type=params['entity_type'],
+                                                      phase=params['phase'])
+
+            # Each page range keeps its own checkpoint
+            facet_spec = dict(facet_spec, phase=f"{params['phase']}_{params['first_page']}")
+            indexer.index_facet(facet_spec=facet_spec, time_period=params['time_period'],
+                                pages=range(params['first_page'], params['last_page']))
+        else:
+            raise ValueError(f"Unknown task type: {task_type}")
+
+    def split_facet(self, params=None):
+        """Queue the facet pages of a facet spec and time period in ranges"""
+
+        indexer, facet_spec = self.get_facet_spec(entity_type=params['entity_type'],
+                                                  phase=params['phase'])
+        num_pages = indexer.count_facet_pages(facet_spec=facet_spec,
+                                              time_period=params['time_period'])
+        if num_pages is None:
+            return
+
+        tasks = []
+        for first_page in range(0, num_pages, self.facet_pages_per_task):
+            tasks.append((3, 'facet_pages', dict(
+                params, first_page=first_page,
+                last_page=min(first_page + self.facet_pages_per_task, num_pages))))
+
+        self.logger.info("Queued %s pages of %s %s in %s tasks.", str(num_pages),
+                         params['phase'], params['time_period'], str(len(tasks)))
+        self.queue.enqueue(tasks=tasks)
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(
+                    prog='Task Worker',
+                    description='Commands to run the queued tasks of an indexing run')
+
+    parser.add_argument("-c", "--config", dest="config_file", action='store', type=str,
+                        default="config/application.yml", help="Configuration file")
+    parser.add_argument("-r", "--run_id", dest="run_id", action='store', type=int,
+                        help="Indexing run to work on, default the last unfinished run.")
+    parser.add_argument("-w", "--workers", dest="workers", action='store', type=int,
+                        default=1, help="Number of tasks to run at the same time.")
+
+    args = parser.parse_args()
+
+    # Create utilities object
+    utilities = Utilities()
+
+    # Load config
+    print("Loading configuration from file: %s", args.config_file)
+    config = utilities.load_config(args.config_file)
+    if not config:
+        print("ERROR: Unable to load configuration.")
+        sys.exit(1)
+
+    # Set up logging
+    logger = utilities.load_logger(config=config)
+
+    checkpoints = Checkpoints(config=config)
+    if not checkpoints.join_run(run_id=args.run_id):
+        sys.exit(0)
+
+    # Write to the same tables as the run
+    indexer_config = config
+    if config.get('use_staging_tables', False):
+        indexer_config = DatabaseManager(config=config).staging_config(config)
+
+    task_worker = RunTaskWorker(config=config, logger=logger, checkpoints=checkpoints,
+                                indexer_config=indexer_config)
+    task_worker.create_clients()
+
+    threads = [threading.Thread(target=task_worker.work) for _ in range(max(args.workers, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    logger.info("No indexing tasks left: %s", task_worker.queue.get_status_counts())
+
+if __name__ == "__main__":
+    main()
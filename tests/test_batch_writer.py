@@ -0,0 +1,100 @@
+"""Tests for the batched database writes"""
+
+import unittest
+
+from unittest import mock
+
+from lib.database import BatchWriter
+
+
+class FakeCursor():
+    """Cursor recording the statements sent with executemany()"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    def executemany(self, query, params_seq):
+        """Record a statement and its parameters"""
+
+        self.connection.executed.append((query, list(params_seq)))
+
+
+class FakeConnection():
+    """Connection recording executed statements and commits"""
+
+    def __init__(self):
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        """Create a recording cursor"""
+
+        return FakeCursor(self)
+
+    def commit(self):
+        """Count a commit"""
+
+        self.commits += 1
+
+
+@mock.patch('lib.database.psycopg.Pipeline.is_supported', return_value=False)
+class BatchWriterTest(unittest.TestCase):
+    """Tests for the batched database writes"""
+
+    def test_grouping(self, _):
+        """Consecutive statements with the same query are sent together, in order"""
+
+        connection = FakeConnection()
+        with BatchWriter(connection, batch_size=100) as writer:
+            writer.execute("INSERT a", (1,))
+            writer.execute("INSERT a", (2,))
+            writer.execute("INSERT b", (3,))
+            writer.executemany("INSERT a", [(4,), (5,)])
+
+        self.assertEqual(connection.executed, [("INSERT a", [(1,), (2,)]),
+                                               ("INSERT b", [(3,)]),
+                                               ("INSERT a", [(4,), (5,)])])
+        self.assertEqual(connection.commits, 1)
+
+    def test_batch_size(self, _):
+        """A full batch is committed as soon as it is queued"""
+
+        connection = FakeConnection()
+        with BatchWriter(connection, batch_size=2) as writer:
+            writer.executemany("INSERT a", [(1,), (2,), (3,)])
+            self.assertEqual(connection.executed, [("INSERT a", [(1,), (2,)])])
+            self.assertEqual(connection.commits, 1)
+
+        self.assertEqual(connection.executed[-1], ("INSERT a", [(3,)]))
+        self.assertEqual(connection.commits, 2)
+
+    def test_error(self, _):
+        """Queued statements are not written if the block fails"""
+
+        connection = FakeConnection()
+        with self.assertRaises(ValueError):
+            with BatchWriter(connection, batch_size=100) as writer:
+                writer.execute("INSERT a", (1,))
+                raise ValueError("Failed")
+
+        self.assertEqual(connection.executed, [])
+        self.assertEqual(connection.commits, 0)
+
+    def test_empty(self, _):
+        """Nothing is committed without statements"""
+
+        connection = FakeConnection()
+        with BatchWriter(connection):
+            pass
+
+        self.assertEqual(connection.commits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
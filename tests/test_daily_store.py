@@ -0,0 +1,114 @@
+"""Tests for the daily statistics store"""
+
+import os
+import tempfile
+import unittest
+
+from datetime import date
+
+from lib.daily_store import DailyStore
+
+
+class DailyStoreTest(unittest.TestCase):
+    """Tests for the daily statistics store"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+        self.first_day = date(2024, 1, 1)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_store(self):
+        """Open the test store"""
+
+        return DailyStore(directory=self.directory, name='item_views',
+                          first_day=self.first_day)
+
+    def test_set_counts(self):
+        """Daily counts are set from their first day and summed over windows"""
+
+        store = self.create_store()
+        store.set_counts(uuids=['a', 'b'], start_day=date(2024, 1, 2),
+                         counts=[[1, 2, 3], [4, 0, 5]])
+
+        uuids, sums = store.window_sums(start_day=date(2024, 1, 1), end_day=date(2024, 1, 4))
+        self.assertEqual(uuids, ['a', 'b'])
+        self.assertEqual(sums.tolist(), [3, 4])
+
+        # Setting days again replaces their counts
+        store.set_counts(uuids=['a'], start_day=date(2024, 1, 3), counts=[[7]])
+        _, sums = store.window_sums(start_day=date(2024, 1, 1), end_day=date(2024, 1, 5))
+        self.assertEqual(sums.tolist(), [11, 9])
+
+    def test_counts_before_first_day(self):
+        """Only the days from the first day on are stored, earlier counts are base counts"""
+
+        store = self.create_store()
+        store.set_counts(uuids=['a'], start_day=date(2023, 12, 1), counts=[[5, 5]])
+        self.assertEqual(store.uuids, [])
+
+        store.set_counts(uuids=['a'], start_day=date(2023, 12, 30), counts=[[5, 5, 1, 2]])
+        _, sums = store.window_sums(start_day=self.first_day, end_day=date(2024, 1, 3))
+        self.assertEqual(sums.tolist(), [3])
+
+        store.set_base(uuids=['a'], counts=[10])
+        store.set_counts(uuids=['a'], start_day=self.first_day, counts=[[1]])
+        _, sums = store.window_sums(start_day=self.first_day, end_day=date(2024, 1, 2))
+        self.assertEqual(sums.tolist(), [1])
+        _, sums = store.window_sums(start_day=self.first_day, end_day=date(2024, 1, 2),
+                                    include_base=True)
+        self.assertEqual(sums.tolist(), [11])
+
+    def test_clear_days(self):
+        """Cleared days are 0 for every entity"""
+
+        store = self.create_store()
+        store.set_counts(uuids=['a', 'b'], start_day=self.first_day,
+                         counts=[[1, 1, 1], [2, 2, 2]])
+        store.clear_days(start_day=date(2024, 1, 2), end_day=date(2024, 1, 3))
+
+        _, sums = store.window_sums(start_day=self.first_day, end_day=date(2024, 1, 4))
+        self.assertEqual(sums.tolist(), [2, 4])
+
+    def test_flush(self):
+        """A flushed store is opened again with its counts and metadata"""
+
+        store = self.create_store()
+        store.set_base(uuids=['b'], counts=[3])
+        store.set_counts(uuids=['a', 'b'], start_day=self.first_day, counts=[[1], [2]])
+        store.flush(filled_until=date(2024, 1, 2))
+        del store
+
+        store = DailyStore(directory=self.directory, name='item_views')
+        self.assertEqual(store.first_day, self.first_day)
+        self.assertEqual(store.filled_until, date(2024, 1, 2))
+        self.assertEqual(store.uuids, ['b', 'a'])
+        _, sums = store.window_sums(start_day=self.first_day, end_day=date(2024, 1, 2),
+                                    include_base=True)
+        self.assertEqual(sums.tolist(), [5, 1])
+        self.assertFalse(os.path.exists(store.metadata_path + '.new'))
+
+    def test_resize(self):
+        """The matrix grows by whole chunks and keeps its counts"""
+
+        store = self.create_store()
+        store.set_counts(uuids=['a'], start_day=self.first_day, counts=[[1]])
+
+        uuids = [f"uuid-{row}" for row in range(DailyStore.row_chunk + 1)]
+        last_day = self.first_day.replace(year=2025)
+        store.set_counts(uuids=uuids[1:], start_day=last_day,
+                         counts=[[1]] * (len(uuids) - 1))
+
+        self.assertEqual(store.matrix.shape, (2 * DailyStore.row_chunk,
+                                              2 * DailyStore.day_chunk))
+        self.assertEqual(store.base.shape, (2 * DailyStore.row_chunk,))
+        _, sums = store.window_sums(start_day=self.first_day, end_day=date(2024, 1, 2))
+        self.assertEqual(sums[0], 1)
+        self.assertEqual(int(sums.sum()), 1)
+        self.assertFalse(os.path.exists(store.matrix_path + '.new'))
+
+
+if __name__ == '__main__':
+    unittest.main()
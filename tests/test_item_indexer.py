@@ -0,0 +1,106 @@
+"""Tests for the partitioning of the item indexer"""
+
+import unittest
+from unittest import mock
+
+from dspace_reports.item_indexer import ItemIndexer
+
+
+class ItemIndexerTest(unittest.TestCase):
+    """Tests for the partitioning of the item indexer"""
+
+    config = {
+        'dspace_server': 'http://localhost:8080/server',
+        'rest_server': 'http://localhost:8080/server/api',
+        'solr_server': 'http://localhost:8983/solr',
+        'statistics_db': {},
+        'work_dir': '/tmp/',
+        'delay': 0
+    }
+
+    def create_indexer(self, partition=None, partitions=None):
+        """Create an item indexer without connecting to the REST API or Solr"""
+
+        return ItemIndexer(self.config, None, rest=object(), solr=object(),
+                           partition=partition, partitions=partitions)
+
+    def test_uuid_ranges(self):
+        """The slices cover the UUID space without gaps or overlaps"""
+
+        indexer = self.create_indexer()
+        partitions = 7
+        ranges = [indexer.get_uuid_range(partition=partition, partitions=partitions)
+                  for partition in range(1, partitions + 1)]
+
+        self.assertEqual(ranges[0][0], '000')
+        self.assertIsNone(ranges[-1][1])
+        for (_, upper), (lower, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(upper, lower)
+
+    def test_single_partition(self):
+        """One partition is the whole UUID space"""
+
+        indexer = self.create_indexer()
+        self.assertEqual(indexer.get_uuid_range(partition=1, partitions=1), ('000', None))
+
+    def test_invalid_partition(self):
+        """Partitions outside 1 to partitions stop the indexer"""
+
+        indexer = self.create_indexer()
+        for partition in [None, 0, 5]:
+            with self.assertRaises(SystemExit):
+                indexer.get_uuid_range(partition=partition, partitions=4)
+
+    def test_in_uuid_range(self):
+        """UUIDs belong to the slice of their leading characters, in any case"""
+
+        first = self.create_indexer(partition=1, partitions=2)
+        last = self.create_indexer(partition=2, partitions=2)
+        self.assertEqual(first.uuid_range, ('000', '800'))
+        self.assertEqual(last.uuid_range, ('800', None))
+
+        for uuid in ['00000000-0000-0000-0000-000000000000',
+                     '7FFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF']:
+            self.assertTrue(first.in_uuid_range(uuid))
+            self.assertFalse(last.in_uuid_range(uuid))
+
+        for uuid in ['80000000-0000-0000-0000-000000000000',
+                     'ffffffff-ffff-ffff-ffff-ffffffffffff']:
+            self.assertFalse(first.in_uuid_range(uuid))
+            self.assertTrue(last.in_uuid_range(uuid))
+
+        self.assertTrue(self.create_indexer().in_uuid_range('80000000'))
+
+    def test_partition_facet_specs(self):
+        """Every slice keeps its own phases, Solr range filter and key range"""
+
+        indexer = self.create_indexer(partition=2, partitions=2)
+        self.assertEqual(indexer.items_phase, 'items_2_of_2')
+        for facet_spec, class_facet_spec in zip(indexer.facet_specs, ItemIndexer.facet_specs):
+            self.assertEqual(facet_spec['phase'], class_facet_spec['phase'] + '_2_of_2')
+            self.assertTrue(facet_spec['filters'].endswith(
+                f" AND {class_facet_spec['facet_field']}:[800 TO *}}"))
+            self.assertEqual(facet_spec['key_range'], ('800', None))
+
+        # The facet specs of the class are not changed
+        self.assertNotIn('key_range', ItemIndexer.facet_specs[0])
+
+    def test_partition_items_from_solr(self):
+        """A partition lists its items in Solr and gets only these from the REST API"""
+
+        solr = mock.Mock()
+        solr.call.return_value.json.return_value = {
+            'response': {'docs': [{'search.resourceid': '9a000000'}]}}
+        rest = mock.Mock()
+        rest.get_item.side_effect = lambda item_uuid=None: {'uuid': item_uuid}
+
+        indexer = ItemIndexer(self.config, None, rest=rest, solr=solr, partition=2,
+                              partitions=2)
+        self.assertEqual(indexer.get_search_items(), [{'uuid': '9a000000'}])
+        self.assertEqual(solr.call.call_args.kwargs['params']['fq'],
+                         ['search.resourceid:[800 TO *}'])
+        rest.get_item.assert_called_once_with(item_uuid='9a000000')
+
+
+if __name__ == '__main__':
+    unittest.main()
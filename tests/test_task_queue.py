@@ -0,0 +1,188 @@
+"""Tests for the queue of indexing tasks
+
+The tests run against the PostgreSQL database given by the PGHOST, PGPORT, PGDATABASE,
+PGUSER and PGPASSWORD environment variables, in a schema that is dropped afterwards.
+They are skipped if PGDATABASE is not set or the database cannot be reached.
+"""
+
+import json
+import logging
+import os
+import unittest
+
+import psycopg
+from psycopg import sql
+
+from database_manager import DatabaseManager
+from lib.database import Database
+from lib.task_queue import TaskQueue
+
+
+class TaskQueueTest(unittest.TestCase):
+    """Tests for the queue of indexing tasks"""
+
+    schema = f"test_task_queue_{os.getpid()}"
+
+    @classmethod
+    def setUpClass(cls):
+        if not os.environ.get('PGDATABASE'):
+            raise unittest.SkipTest("PGDATABASE is not set.")
+
+        cls.config = {
+            'statistics_db': {
+                'name': os.environ['PGDATABASE'],
+                'username': os.environ.get('PGUSER', 'postgres'),
+                'password': os.environ.get('PGPASSWORD', ''),
+                'host': os.environ.get('PGHOST', 'localhost'),
+                'port': os.environ.get('PGPORT', '5432'),
+                'schema': cls.schema
+            }
+        }
+
+        try:
+            cls.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(cls.schema)))
+        except psycopg.OperationalError as err:
+            raise unittest.SkipTest(f"Unable to connect to the database: {err}")
+
+        DatabaseManager(config=cls.config).create_run_state_tables(
+            cls.config, logging.getLogger('dspace-reports'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.execute(sql.SQL("DROP SCHEMA {} CASCADE").format(sql.Identifier(cls.schema)))
+
+    @classmethod
+    def execute(cls, query, params=None):
+        """Run a statement in the test schema and return its rows"""
+
+        with psycopg.Connection.connect(**cls.get_connection_params()) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall() if cursor.description else []
+            connection.commit()
+
+        return rows
+
+    @classmethod
+    def get_connection_params(cls):
+        """Get the connection parameters of the test database"""
+
+        db_config = cls.config['statistics_db']
+        return {'dbname': db_config['name'], 'user': db_config['username'],
+                'password': db_config['password'], 'host': db_config['host'],
+                'port': db_config['port'], 'options': f"-c search_path={cls.schema}"}
+
+    def setUp(self):
+        run_id = self.execute("INSERT INTO indexing_runs (started_at) VALUES (now()) RETURNING run_id")[0][0]
+        self.queue = TaskQueue(config=self.config, run_id=run_id, max_attempts=2,
+                               task_timeout=300)
+
+    def set_heartbeat_age(self, task_id=None, seconds=None):
+        """Move the last heartbeat of a task into the past"""
+
+        self.execute("UPDATE indexing_tasks SET heartbeat_at = now() - make_interval(secs => %s) WHERE task_id = %s", (seconds, task_id))
+
+    def test_schema(self):
+        """The queue uses the tables of the test schema"""
+
+        with Database(self.config['statistics_db']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT current_schema()")
+                self.assertEqual(cursor.fetchone()[0], self.schema)
+
+    def test_stages(self):
+        """Tasks are claimed stage by stage, and only once the earlier stages are done"""
+
+        self.queue.enqueue(tasks=[(2, 'facet', {'phase': 'item_views'}),
+                                  (1, 'items', {'partition': 1}),
+                                  (1, 'items', {'partition': 2})])
+
+        first = self.queue.claim(worker='a')
+        second = self.queue.claim(worker='b')
+        self.assertEqual([first['task_type'], second['task_type']], ['items', 'items'])
+        self.assertEqual(first['params'], {'partition': 1})
+
+        # The facet task waits for the running items tasks
+        self.assertIsNone(self.queue.claim(worker='c'))
+        self.queue.complete(task_id=first['task_id'])
+        self.assertIsNone(self.queue.claim(worker='c'))
+        self.assertFalse(self.queue.is_finished())
+
+        self.queue.complete(task_id=second['task_id'])
+        third = self.queue.claim(worker='c')
+        self.assertEqual(third['task_type'], 'facet')
+        self.queue.complete(task_id=third['task_id'])
+
+        self.assertTrue(self.queue.is_finished())
+        self.assertEqual(self.queue.get_status_counts(), {'done': 3})
+
+    def test_skip_locked(self):
+        """A task locked by the claim of another worker is skipped, not waited for"""
+
+        self.queue.enqueue(tasks=[(1, 'items', {'partition': 1}),
+                                  (1, 'items', {'partition': 2})])
+
+        with psycopg.Connection.connect(**self.get_connection_params()) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT task_id FROM indexing_tasks WHERE run_id = %s ORDER BY task_id LIMIT 1 FOR UPDATE", (self.queue.run_id,))
+                locked_task_id = cursor.fetchone()[0]
+
+                task = self.queue.claim(worker='a')
+                self.assertNotEqual(task['task_id'], locked_task_id)
+                self.assertEqual(task['params'], {'partition': 2})
+
+    def test_duplicate_tasks(self):
+        """A task the run already has is not queued again"""
+
+        self.queue.enqueue(tasks=[(1, 'items', {'partition': 1, 'partitions': 2})])
+        self.queue.enqueue(tasks=[(1, 'items', {'partitions': 2, 'partition': 1})])
+
+        rows = self.execute("SELECT params FROM indexing_tasks WHERE run_id = %s",
+                            (self.queue.run_id,))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(json.loads(rows[0][0]), {'partition': 1, 'partitions': 2})
+
+    def test_retry(self):
+        """A failed task is retried until its last attempt, then left failed"""
+
+        self.queue.enqueue(tasks=[(1, 'repository', {}), (2, 'facet', {})])
+
+        task = self.queue.claim(worker='a')
+        self.queue.fail(task_id=task['task_id'], error='Solr timeout')
+        task = self.queue.claim(worker='a')
+        self.assertEqual((task['task_type'], task['attempts']), ('repository', 2))
+
+        self.queue.fail(task_id=task['task_id'], error='Solr timeout')
+        self.assertEqual(self.queue.get_status_counts(), {'failed': 1, 'pending': 1})
+
+        # The later stage can never run, so nothing is left to do
+        self.assertIsNone(self.queue.claim(worker='a'))
+        self.assertTrue(self.queue.is_finished())
+
+        # Failed tasks get new attempts, e.g. when the run is resumed
+        self.queue.retry_failed()
+        task = self.queue.claim(worker='a')
+        self.assertEqual((task['task_type'], task['attempts']), ('repository', 1))
+
+    def test_lost_worker(self):
+        """A running task without heartbeats is claimed again, up to its last attempt"""
+
+        self.queue.enqueue(tasks=[(1, 'repository', {})])
+
+        task = self.queue.claim(worker='a')
+        self.set_heartbeat_age(task_id=task['task_id'], seconds=400)
+        self.queue.heartbeat(task_id=task['task_id'])
+        self.assertIsNone(self.queue.claim(worker='b'))
+
+        self.set_heartbeat_age(task_id=task['task_id'], seconds=400)
+        task = self.queue.claim(worker='b')
+        self.assertEqual(task['attempts'], 2)
+
+        self.set_heartbeat_age(task_id=task['task_id'], seconds=400)
+        self.assertIsNone(self.queue.claim(worker='c'))
+        self.assertEqual(self.queue.get_status_counts(), {'failed': 1})
+        self.assertTrue(self.queue.is_finished())
+
+
+if __name__ == '__main__':
+    unittest.main()